@@ -4,6 +4,8 @@ class Config(object):
     API_ID = int(environ.get("API_ID", 27190467))
     API_HASH = environ.get("API_HASH", "ff6bc6ad2faba520f426cf04ca7f5773")
     BOT_TOKEN = environ.get("BOT_TOKEN", "7240304290:AAFkHLSw_rSnIZRG0TVCcR2t87l_TcHzfeI")
+    # Extra bot tokens (space separated) used only for uploads; each bot must be a member of the target chats
+    EXTRA_BOT_TOKENS = environ.get("EXTRA_BOT_TOKENS", "").split()
     
     # Combine AUTH_USERS and AUTH_GROUPS into a single list
     AUTH_USERS = list(int(x) for x in environ.get("AUTH_USERS", "6066102279 1885207148 6623741903").split(" "))
@@ -12,3 +14,103 @@ class Config(object):
     CREDITS = environ.get("CREDITS", "SharkToonsIndia")  # Default value is "SharkToonsIndia"
     DOWNLOAD_DIRECTORY = environ.get("DOWNLOAD_DIRECTORY", "./downloads")
     BIN_DIRECTORY = environ.get("BIN_DIRECTORY", "./bin")
+
+    # Auto-select: highest variant whose probe sustains this realtime factor
+    AUTO_SELECT_MIN_REALTIME = float(environ.get("AUTO_SELECT_MIN_REALTIME", 1.2))
+    AUTO_PROBE_SEGMENTS = int(environ.get("AUTO_PROBE_SEGMENTS", 3))
+    # Format URLs are often tokenized; a capture re-probes the link when its last probe is older than this (s)
+    FORMATS_MAX_AGE = int(environ.get("FORMATS_MAX_AGE", 120))
+
+    # Per-origin governor: concurrent ingests per CDN host and how long a job may queue for a slot
+    MAX_INGESTS_PER_ORIGIN = int(environ.get("MAX_INGESTS_PER_ORIGIN", 3))
+    ORIGIN_QUEUE_TIMEOUT = int(environ.get("ORIGIN_QUEUE_TIMEOUT", 600))
+
+    # IPTV catalog: on-disk copy and background refresh interval (seconds)
+    CATALOG_CACHE_PATH = environ.get("CATALOG_CACHE_PATH", "./downloads/catalog.json")
+    CATALOG_REFRESH_INTERVAL = int(environ.get("CATALOG_REFRESH_INTERVAL", 900))
+
+    # Extra seconds captured beyond the requested duration so tracks can be aligned and trimmed
+    SYNC_CAPTURE_PADDING = int(environ.get("SYNC_CAPTURE_PADDING", 12))
+
+    # Transcoding: threads per encode (pool = cores / threads), niceness, realtime floor and copy-lane width
+    TRANSCODE_THREADS = int(environ.get("TRANSCODE_THREADS", 2))
+    TRANSCODE_NICE = int(environ.get("TRANSCODE_NICE", 10))
+    TRANSCODE_MIN_REALTIME = float(environ.get("TRANSCODE_MIN_REALTIME", 1.0))
+    MAX_COPY_JOBS = int(environ.get("MAX_COPY_JOBS", 8))
+
+    # Per-job process limits (0 disables); JOB_CGROUP_ROOT is a writable cgroup v2 directory, if any
+    JOB_MAX_RSS_MB = int(environ.get("JOB_MAX_RSS_MB", 768))
+    JOB_MAX_CPU_SECONDS = int(environ.get("JOB_MAX_CPU_SECONDS", 0))
+    JOB_MAX_FILE_MB = int(environ.get("JOB_MAX_FILE_MB", 0))
+    JOB_CGROUP_ROOT = environ.get("JOB_CGROUP_ROOT", "")
+    PROCESS_SAMPLE_INTERVAL = float(environ.get("PROCESS_SAMPLE_INTERVAL", 5))
+
+    # Watchdog: kill jobs without output progress for STALL_TIMEOUT seconds or past duration + DEADLINE_GRACE
+    STALL_TIMEOUT = int(environ.get("STALL_TIMEOUT", 60))
+    DEADLINE_GRACE = int(environ.get("DEADLINE_GRACE", 120))
+    MAX_STALL_RESTARTS = int(environ.get("MAX_STALL_RESTARTS", 3))
+
+    # Shared ingests: segment length and how long an ingest outlives its last subscriber
+    SHARED_SEGMENT_SECONDS = int(environ.get("SHARED_SEGMENT_SECONDS", 4))
+    SHARED_INGEST_LINGER = int(environ.get("SHARED_INGEST_LINGER", 30))
+
+    # Recording catalog (SQLite) and how far a stored window may differ from a request and still be reused
+    RECORDINGS_DB = environ.get("RECORDINGS_DB", "./downloads/recordings.db")
+    RECORDING_MATCH_TOLERANCE = int(environ.get("RECORDING_MATCH_TOLERANCE", 15))
+
+    # Uploads: parallel parts per file, concurrent files, retries per part and progress edit interval (seconds)
+    UPLOAD_PART_WORKERS = int(environ.get("UPLOAD_PART_WORKERS", 8))
+    MAX_CONCURRENT_UPLOADS = int(environ.get("MAX_CONCURRENT_UPLOADS", 2))
+    UPLOAD_PART_RETRIES = int(environ.get("UPLOAD_PART_RETRIES", 5))
+    UPLOAD_PROGRESS_INTERVAL = float(environ.get("UPLOAD_PROGRESS_INTERVAL", 10))
+
+    # Write-ahead journal of job stages, replayed on startup to resume interrupted jobs
+    JOB_JOURNAL = environ.get("JOB_JOURNAL", "./downloads/journal.jsonl")
+
+    # Capture validation: PTS jump counted as a gap, silence before a stream is declared dead, minimum coverage to upload
+    GAP_THRESHOLD = float(environ.get("GAP_THRESHOLD", 1.0))
+    DEAD_STREAM_SECONDS = int(environ.get("DEAD_STREAM_SECONDS", 90))
+    MIN_COVERAGE = float(environ.get("MIN_COVERAGE", 0.5))
+
+    # Logging: level, JSON log file (empty disables), rotation, writer queue size and per-call-site INFO rate limit
+    LOG_LEVEL = environ.get("LOG_LEVEL", "INFO")
+    LOG_FILE = environ.get("LOG_FILE", "./logs/bot.jsonl")
+    LOG_MAX_MB = int(environ.get("LOG_MAX_MB", 50))
+    LOG_BACKUPS = int(environ.get("LOG_BACKUPS", 5))
+    LOG_QUEUE_SIZE = int(environ.get("LOG_QUEUE_SIZE", 10000))
+    LOG_RATE_LIMIT = int(environ.get("LOG_RATE_LIMIT", 20))
+    LOG_RATE_WINDOW = float(environ.get("LOG_RATE_WINDOW", 10))
+
+    # DVR: channels (catalog names or links, comma separated) kept in a rolling on-disk buffer, bounded by minutes and MB
+    DVR_CHANNELS = [entry.strip() for entry in environ.get("DVR_CHANNELS", "").split(",") if entry.strip()]
+    DVR_MINUTES = int(environ.get("DVR_MINUTES", 30))
+    DVR_MAX_MB = int(environ.get("DVR_MAX_MB", 2048))
+
+    # EPG: XMLTV guide (URL or local path, empty disables), its cache, refresh interval (s) and auto-record rules
+    EPG_SOURCE = environ.get("EPG_SOURCE", "")
+    EPG_CACHE_PATH = environ.get("EPG_CACHE_PATH", "./downloads/epg_cache.json")
+    EPG_REFRESH_INTERVAL = int(environ.get("EPG_REFRESH_INTERVAL", 6 * 3600))
+    EPG_RULES_PATH = environ.get("EPG_RULES_PATH", "./downloads/epg_rules.json")
+    # Auto-recordings start EPG_PADDING_BEFORE early and end EPG_PADDING_AFTER late; closer programmes share a capture
+    EPG_PADDING_BEFORE = int(environ.get("EPG_PADDING_BEFORE", 60))
+    EPG_PADDING_AFTER = int(environ.get("EPG_PADDING_AFTER", 180))
+    EPG_LOOKAHEAD = int(environ.get("EPG_LOOKAHEAD", 300))
+
+    # Delivery pipeline: probe and fan-out workers (uploads use MAX_CONCURRENT_UPLOADS), queue bound per stage
+    PROBE_WORKERS = int(environ.get("PROBE_WORKERS", 2))
+    FANOUT_WORKERS = int(environ.get("FANOUT_WORKERS", 2))
+    PIPELINE_QUEUE_SIZE = int(environ.get("PIPELINE_QUEUE_SIZE", 4))
+    # New recordings are refused while free space in the downloads directory is below this
+    MIN_FREE_DISK_MB = int(environ.get("MIN_FREE_DISK_MB", 1024))
+
+    # /stats dashboard: seconds between edits and how long it keeps refreshing
+    STATS_REFRESH_INTERVAL = int(environ.get("STATS_REFRESH_INTERVAL", 10))
+    STATS_REFRESH_DURATION = int(environ.get("STATS_REFRESH_DURATION", 300))
+
+    # Debug: report event-loop callbacks running longer than this many ms, with their stacks (0 disables)
+    BLOCKING_DETECTOR_MS = int(environ.get("BLOCKING_DETECTOR_MS", 0))
+
+    # Batch job lists (JSONL/CSV documents): size and job limits, seconds between status message edits
+    BATCH_MAX_BYTES = int(environ.get("BATCH_MAX_BYTES", 1024 * 1024))
+    BATCH_MAX_JOBS = int(environ.get("BATCH_MAX_JOBS", 100))
+    BATCH_STATUS_INTERVAL = int(environ.get("BATCH_STATUS_INTERVAL", 15))
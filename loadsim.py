@@ -0,0 +1,159 @@
+"""Load simulator for the /record interaction handlers.
+
+Drives `record_command` and `handle_selection` from main.py with synthetic
+users through stub messages and callback queries, so no Telegram
+connection, yt_dlp probe or ffmpeg process is involved: `parse_streams`
+returns synthetic formats after a simulated probe delay and
+`start_recording` returns immediately. For each concurrency level it
+reports handler latency percentiles (without the simulated probe delay,
+which stands in for network time, not handler work) and event-loop lag,
+and exits
+non-zero when the p99 latency breaks the SLO, so it can gate CI:
+
+    python loadsim.py --users 1 10 50 200 --slo-p99-ms 250
+
+With --detect-blocking MS it also runs the blocking-call detector and
+fails when any callback held the loop longer than MS.
+"""
+import argparse
+import asyncio
+import contextvars
+import math
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+import main
+from utils import BlockingCallDetector
+
+class StubMessage:
+    """Just enough of pyrogram's Message for the handlers under test."""
+
+    def __init__(self, user_id: int, text: str = ""):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat = SimpleNamespace(id=user_id)
+        self.text = text
+        self.reply_markup = None
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        return StubMessage(self.from_user.id, text)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        self.text, self.reply_markup = text, reply_markup
+        return self
+
+class StubQuery:
+    def __init__(self, user_id: int, data: str, message: StubMessage):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.data = data
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+def synthetic_streams(audio_count: int, video_count: int):
+    audio = [f"{i} - aac - {64 + 32 * (i % 4)}kbps - lang{i}" for i in range(audio_count)]
+    video = [f"{100 + i} - {240 + 120 * (i % 8)}p - avc1.64001f - {500 + 250 * i}kbps" for i in range(video_count)]
+    return audio, video, []
+
+# Seconds the current handler call spent in the stubbed probe
+probe_seconds = contextvars.ContextVar("probe_seconds", default=0.0)
+
+def install_stubs(args):
+    """Replace the network- and ffmpeg-bound parts of main with synthetic ones."""
+    async def parse_streams(link):
+        started = time.perf_counter()
+        await asyncio.sleep(args.probe_ms / 1000)
+        probe_seconds.set(probe_seconds.get() + time.perf_counter() - started)
+        return synthetic_streams(args.audio_tracks, args.video_tracks)
+
+    async def start_recording(user_id, state=None):
+        main.user_states.pop(user_id, None)
+
+    main.parse_streams = parse_streams
+    main.start_recording = start_recording
+
+async def timed(latencies, handler, *handler_args):
+    probe_seconds.set(0.0)
+    started = time.perf_counter()
+    await handler(None, *handler_args)
+    latencies.append(time.perf_counter() - started - probe_seconds.get())
+
+async def simulate_user(user_id: int, args, latencies):
+    """One /record interaction: pick audio tracks, page through video variants, confirm."""
+    link = f"https://example.com/{user_id % args.channels}/master.m3u8"
+    message = StubMessage(user_id, f"/record {link} 00:10:00 Title{user_id} Channel{user_id % args.channels}")
+    await timed(latencies, main.record_command, message)
+
+    keyboard = StubMessage(user_id)
+    pages = math.ceil(args.video_tracks / main.BUTTONS_PER_PAGE)
+    presses = [f"audio_{random.randrange(args.audio_tracks)}" for _ in range(2)] + ["audio_confirm"]
+    presses += [f"video_p{page}" for page in range(1, pages)] + [f"video_{random.randrange(args.video_tracks)}", "video_confirm"]
+    for data in presses:
+        await asyncio.sleep(random.uniform(0, args.think_ms / 1000))
+        await timed(latencies, main.handle_selection, StubQuery(user_id, data, keyboard))
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+async def run_level(users: int, args, lag) -> dict:
+    latencies = []
+    lag.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(user_id, args, latencies) for user_id in range(users)))
+    elapsed = time.perf_counter() - started
+    return {
+        "users": users,
+        "calls": len(latencies),
+        "rate": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "max": max(latencies) * 1000,
+        "lag_p99": lag.percentile(99),
+        "lag_max": lag.max * 1000,
+    }
+
+async def run(args) -> int:
+    install_stubs(args)
+    lag = main.LoopLagMonitor(interval=0.01)
+    lag.start()
+    detector = BlockingCallDetector(args.detect_blocking / 1000) if args.detect_blocking else None
+    if detector is not None:
+        detector.install()
+    print(f"{'users':>6} {'calls':>7} {'calls/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'lag p99':>8} {'lag max':>8}")
+    failed = False
+    for users in args.users:
+        result = await run_level(users, args, lag)
+        breach = args.slo_p99_ms and result["p99"] > args.slo_p99_ms
+        failed = failed or breach
+        print(f"{result['users']:>6} {result['calls']:>7} {result['rate']:>8.0f} {result['p50']:>8.1f} {result['p95']:>8.1f} "
+              f"{result['p99']:>8.1f} {result['max']:>8.1f} {result['lag_p99']:>8.0f} {result['lag_max']:>8.1f}"
+              f"{'  SLO BREACH' if breach else ''}")
+    if detector is not None:
+        detector.uninstall()
+        print(detector.report())
+        failed = failed or bool(detector.offenders)
+    return 1 if failed else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 50, 100, 250],
+                        help="concurrent synthetic users per level")
+    parser.add_argument("--channels", type=int, default=20, help="distinct links the users spread over")
+    parser.add_argument("--audio-tracks", type=int, default=8)
+    parser.add_argument("--video-tracks", type=int, default=24)
+    parser.add_argument("--probe-ms", type=float, default=50, help="simulated parse_streams latency")
+    parser.add_argument("--think-ms", type=float, default=200, help="maximum pause between button presses")
+    parser.add_argument("--slo-p99-ms", type=float, default=0, help="fail when any level's p99 exceeds this")
+    parser.add_argument("--detect-blocking", type=float, default=0, metavar="MS",
+                        help="report callbacks blocking the loop longer than MS, and fail if there are any")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    random.seed(args.seed)
+    sys.exit(asyncio.run(run(args)))
@@ -2,34 +2,196 @@ import os
 import asyncio
 import logging
 import json
+import csv
+import io
+import inspect
+import math
+import itertools
 import time
 import shlex
+import html
 import ffmpeg
 import shutil
+import sqlite3
+import threading
+from functools import lru_cache
+import signal
+import resource
+from collections import defaultdict, deque
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle, raw
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
 import subprocess
 from hachoir.metadata import extractMetadata
 from hachoir.parser import createParser
 import re
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from pyrogram.types import (
+    Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent,
+)
 import yt_dlp
 from config import *
 from config import Config
+from utils import measure_throughput, channel_catalog, channel_index, fetch_playlist, align_playlists, TSValidator
+from utils import setup_logging, bind_log_context, epg_guide, epg_index, BlockingCallDetector
 
-# Logging setup
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Logging setup: queue-backed writer thread, JSON file records carrying job_id/user_id
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
+UPLOAD_PART_SIZE = 512 * 1024  # Telegram's maximum part size
+BIG_FILE_SIZE = 10 * 1024 * 1024  # Files above this use SaveBigFilePart
+
+class LiveRecordClient(Client):
+    """Client whose big-file uploads send parts in parallel and retry failed parts individually.
+
+    A part that fails is retried on its own (sleeping through FloodWait),
+    so a transient error no longer restarts a multi-GB upload from byte 0.
+    Small files and file objects keep pyrogram's own uploader.
+    """
+
+    part_workers = Config.UPLOAD_PART_WORKERS
+
+    @property
+    def upload_limit(self) -> int:
+        """Largest file Telegram accepts from this account, in bytes (as checked by pyrogram's uploader)."""
+        return (4000 if getattr(self.me, "is_premium", False) else 2000) * 1024 * 1024
+
+    async def save_file(self, path, file_id: int = None, file_part: int = 0, progress=None, progress_args: tuple = (),
+                        part_workers: int = None):
+        if not isinstance(path, str) or os.path.getsize(path) <= BIG_FILE_SIZE:
+            return await super().save_file(path, file_id, file_part, progress, progress_args)
+
+        file_size = os.path.getsize(path)
+        if file_size > self.upload_limit:
+            raise ValueError(f"Can't upload files bigger than {self.upload_limit // (1024 * 1024)} MiB")
+        total_parts = math.ceil(file_size / UPLOAD_PART_SIZE)
+        file_id = file_id or self.rnd_id()
+        parts = asyncio.Queue()
+        for part in range(file_part, total_parts):
+            parts.put_nowait(part)
+        uploaded = file_part * UPLOAD_PART_SIZE
+
+        session = Session(self, await self.storage.dc_id(), await self.storage.auth_key(),
+                          await self.storage.test_mode(), is_media=True)
+        await session.start()
+
+        def read_part(part: int) -> bytes:
+            with open(path, "rb") as f:
+                f.seek(part * UPLOAD_PART_SIZE)
+                return f.read(UPLOAD_PART_SIZE)
+
+        async def worker():
+            nonlocal uploaded
+            while not parts.empty():
+                part = parts.get_nowait()
+                chunk = await asyncio.to_thread(read_part, part)
+                rpc = raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id, file_part=part, file_total_parts=total_parts, bytes=chunk
+                )
+                attempt = 0
+                while True:
+                    try:
+                        await session.invoke(rpc)
+                        break
+                    except FloodWait as e:
+                        await asyncio.sleep(e.value)  # Rate limiting, not a failure: doesn't use up a retry
+                    except Exception as e:
+                        if attempt == Config.UPLOAD_PART_RETRIES:
+                            raise
+                        logger.warning(f"Upload part {part}/{total_parts} of {path} failed ({e}); retrying")
+                        metrics["upload_part_retries"] += 1
+                        await asyncio.sleep(min(2 ** attempt, 30))
+                        attempt += 1
+                uploaded += len(chunk)
+                if progress:
+                    result = progress(min(uploaded, file_size), file_size, *progress_args)
+                    if inspect.isawaitable(result):
+                        await result
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, part_workers or self.part_workers))))
+        finally:
+            await session.stop()
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=os.path.basename(path))
+
 # Bot instance
-bot = Client(
+bot = LiveRecordClient(
     "LiveRecordBot",
     bot_token=Config.BOT_TOKEN,
     api_id=Config.API_ID,
     api_hash=Config.API_HASH,
 )
 
+class ClientPool:
+    """The primary bot plus upload-only sessions from EXTRA_BOT_TOKENS.
+
+    Uploads and copies go to the least-loaded client that is not sitting
+    out a FloodWait; a FloodWait moves the call to the next client.
+    Handlers and user-facing messages stay on the primary client.
+    """
+
+    def __init__(self, primary: Client, tokens: List[str]):
+        self.primary = primary
+        self.clients = [primary] + [
+            LiveRecordClient(
+                f"LiveRecordBot_{i}",
+                bot_token=token,
+                api_id=Config.API_ID,
+                api_hash=Config.API_HASH,
+                no_updates=True,
+            ) for i, token in enumerate(tokens, start=1)
+        ]
+        self.load: Dict[str, int] = defaultdict(int)
+        self.flood_until: Dict[str, float] = {}
+
+    async def start(self):
+        for client in self.clients[1:]:
+            try:
+                await client.start()
+            except Exception as e:
+                logger.error(f"Could not start upload client {client.name}: {e}")
+                self.clients.remove(client)
+
+    async def stop(self):
+        for client in self.clients[1:]:
+            await client.stop()
+
+    def by_name(self, name: str) -> Client:
+        return next((client for client in self.clients if client.name == name), self.primary)
+
+    def pick(self) -> Client:
+        now = time.monotonic()
+        ready = [client for client in self.clients if self.flood_until.get(client.name, 0) <= now]
+        if not ready:
+            return min(self.clients, key=lambda client: self.flood_until[client.name])
+        return min(ready, key=lambda client: self.load[client.name])
+
+    async def run(self, call, attempts: int = None):
+        """Await `call(client)` on the least-loaded client, failing over on FloodWait."""
+        for attempt in range(attempts or len(self.clients) + 1):
+            client = self.pick()
+            wait = self.flood_until.get(client.name, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.load[client.name] += 1
+            try:
+                return await call(client)
+            except FloodWait as e:
+                logger.warning(f"{client.name} hit FloodWait for {e.value}s; failing over")
+                metrics["flood_waits"] += 1
+                self.flood_until[client.name] = time.monotonic() + e.value
+            finally:
+                self.load[client.name] -= 1
+        raise RuntimeError("All clients are rate limited")
+
+client_pool = ClientPool(bot, Config.EXTRA_BOT_TOKENS)
+
 # Directory for saving recordings
 DOWNLOADS_DIR = Config.DOWNLOAD_DIRECTORY
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
@@ -37,6 +199,8 @@ os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 # Global user state tracking
 user_states: Dict[int, Dict] = {}
 user_sessions = {}
+stream_formats: Dict[str, Dict[str, List[dict]]] = {}  # yt_dlp format dicts aligned with parse_streams lists
+stream_probed: Dict[str, float] = {}  # link -> when stream_formats[link] was last probed
 chat_id = -1002384253271
 dump_chat_id = -1002013773334
 dump_other_chat_id = -1002365246278
@@ -44,8 +208,581 @@ pm_auth_users = [6066102279]
 
 # Telegram max message length
 MAX_MESSAGE_LENGTH = 4096
+CHANNELS_PER_PAGE = 25
+BUTTONS_PER_PAGE = 10
+BUTTON_LABEL_LENGTH = 36
+channel_queries: Dict[int, str] = {}  # Last /channels query per user, for pagination
+
+class OriginGovernor:
+    """Limits concurrent ingests per origin host and tracks the throughput each host delivers."""
+
+    def __init__(self, max_ingests: int, queue_timeout: float, smoothing: float = 0.3):
+        self.max_ingests = max_ingests
+        self.queue_timeout = queue_timeout
+        self.smoothing = smoothing
+        self.active: Dict[str, int] = defaultdict(int)
+        self.committed_kbps: Dict[str, float] = defaultdict(float)
+        self.capacity_kbps: Dict[str, float] = {}  # EWMA of aggregate throughput seen per host
+        self.waiting: Dict[str, int] = defaultdict(int)
+        self._conditions: Dict[str, asyncio.Condition] = {}
+
+    @staticmethod
+    def host(link: str) -> str:
+        return urlparse(link).hostname or link
+
+    def saturated(self, link: str) -> bool:
+        return self.active[self.host(link)] >= self.max_ingests
+
+    def headroom(self, link: str):
+        """Spare kbps on the origin, or None while its capacity is still unknown."""
+        host = self.host(link)
+        if host not in self.capacity_kbps:
+            return None
+        return self.capacity_kbps[host] - self.committed_kbps[host]
+
+    def observe(self, link: str, kbps: float):
+        """Record the throughput one ingest achieved while sharing the host with the others."""
+        host = self.host(link)
+        aggregate = kbps * max(self.active[host], 1)
+        previous = self.capacity_kbps.get(host)
+        self.capacity_kbps[host] = aggregate if previous is None else (
+            self.smoothing * aggregate + (1 - self.smoothing) * previous
+        )
+
+    @asynccontextmanager
+    async def slot(self, link: str, bitrate_kbps: float = 0):
+        host = self.host(link)
+        condition = self._conditions.setdefault(host, asyncio.Condition())
+        async with condition:
+            self.waiting[host] += 1
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self.active[host] < self.max_ingests),
+                    timeout=self.queue_timeout,
+                )
+            finally:
+                self.waiting[host] -= 1
+            self.active[host] += 1
+            self.committed_kbps[host] += bitrate_kbps
+        try:
+            yield host
+        finally:
+            async with condition:
+                self.active[host] -= 1
+                self.committed_kbps[host] -= bitrate_kbps
+                condition.notify_all()
+
+origin_governor = OriginGovernor(Config.MAX_INGESTS_PER_ORIGIN, Config.ORIGIN_QUEUE_TIMEOUT)
+
+# Job status and process metrics
+job_status: Dict[str, Dict] = {}
+metrics: Dict[str, float] = defaultdict(float)
+
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a task that sleeps `interval` seconds.
+
+    Every sample also lands in a histogram of LAG_BUCKETS_MS, so tail lag
+    (p99) is visible, not just the average.
+    """
+
+    def __init__(self, interval: float = 0.5, smoothing: float = 0.2):
+        self.interval = interval
+        self.smoothing = smoothing
+        self.reset()
+        self._task = None
+
+    def reset(self):
+        self.last = 0.0
+        self.average = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound (ms) of the bucket holding the q-th percentile sample; inf past the last bucket."""
+        total = sum(self.histogram)
+        if not total:
+            return 0.0
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= q / 100 * total:
+                return LAG_BUCKETS_MS[i] if i < len(LAG_BUCKETS_MS) else math.inf
+        return math.inf
+
+    def record(self, lag: float):
+        self.last = lag
+        self.average = self.smoothing * lag + (1 - self.smoothing) * self.average
+        self.max = max(self.max, lag)
+        self.histogram[bisect_left(LAG_BUCKETS_MS, lag * 1000)] += 1
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.record(max(time.monotonic() - started - self.interval, 0.0))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+loop_lag = LoopLagMonitor()
+blocking_detector = BlockingCallDetector(Config.BLOCKING_DETECTOR_MS / 1000) if Config.BLOCKING_DETECTOR_MS else None
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def apply_job_rlimits(pid: int):
+    """Apply the configured CPU and file-size rlimits to a just-spawned job.
+
+    Set from the parent with prlimit: a preexec_fn can deadlock the child of
+    a multi-threaded process like this one.
+    """
+    try:
+        if Config.JOB_MAX_CPU_SECONDS:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (Config.JOB_MAX_CPU_SECONDS, Config.JOB_MAX_CPU_SECONDS))
+        if Config.JOB_MAX_FILE_MB:
+            limit = Config.JOB_MAX_FILE_MB * 1024 * 1024
+            resource.prlimit(pid, resource.RLIMIT_FSIZE, (limit, limit))
+    except ProcessLookupError:
+        pass  # Already exited
+
+class ProcessTracker:
+    """Tracks every spawned ffmpeg/ffprobe by job and samples its usage from /proc.
+
+    Usage is summed over the whole process tree (the process and any
+    children it spawns), folded into `job_status[job_id]["usage"]`, and a
+    tree exceeding JOB_MAX_RSS_MB is killed before it can take the dyno down.
+    /proc is read in a worker thread; the results are applied on the loop.
+    """
+
+    def __init__(self, interval: float, max_rss_mb: int, cgroup_root: str = ""):
+        self.interval = interval
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.cgroup_root = cgroup_root
+        self.processes: Dict[int, Dict] = {}
+        self._task = None
+
+    def register(self, pid: int, job_id: str, cmd: str):
+        self.processes[pid] = {"job_id": job_id, "cmd": cmd, "started": time.time(),
+                               "rss": 0, "peak_rss": 0, "cpu": 0.0, "write_bytes": 0}
+        metrics["processes_spawned"] += 1
+        if self.cgroup_root and job_id:
+            self._attach_cgroup(pid, job_id)
+
+    def unregister(self, pid: int, rusage=None):
+        """Stop tracking `pid`; `rusage` from os.wait4 gives final totals even for a never-sampled process."""
+        proc = self.processes.pop(pid, None)
+        if not proc:
+            return
+        if self.cgroup_root and proc["job_id"] and not any(p["job_id"] == proc["job_id"] for p in self.processes.values()):
+            self._remove_cgroup(proc["job_id"])
+        if rusage is not None:
+            proc["cpu"] = max(proc["cpu"], rusage.ru_utime + rusage.ru_stime)
+            proc["peak_rss"] = max(proc["peak_rss"], rusage.ru_maxrss * 1024)  # ru_maxrss is in KiB
+            proc["write_bytes"] = max(proc["write_bytes"], rusage.ru_oublock * 512)
+        self._fold(proc)
+
+    def _attach_cgroup(self, pid: int, job_id: str):
+        path = os.path.join(self.cgroup_root, f"job-{job_id}")
+        try:
+            os.makedirs(path, exist_ok=True)
+            if self.max_rss:
+                with open(os.path.join(path, "memory.max"), "w") as f:
+                    f.write(str(self.max_rss))
+            with open(os.path.join(path, "cgroup.procs"), "w") as f:
+                f.write(str(pid))
+        except OSError as e:
+            logger.warning(f"Could not place pid {pid} in cgroup {path}: {e}")
+
+    def _remove_cgroup(self, job_id: str):
+        path = os.path.join(self.cgroup_root, f"job-{job_id}")
+        try:
+            os.rmdir(path)  # Succeeds once the group has no processes left
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove cgroup {path}: {e}")
+
+    @staticmethod
+    def _children() -> Dict[int, List[int]]:
+        children = defaultdict(list)
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                    children[ppid].append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+        return children
+
+    @staticmethod
+    def _read_usage(pid: int) -> Tuple[int, float, int]:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime, stime, cutime, cstime are fields 14-17; rss (pages) is field 24
+        cpu = sum(int(value) for value in fields[11:15]) / CLOCK_TICKS
+        rss = int(fields[21]) * PAGE_SIZE
+        write_bytes = 0
+        try:
+            with open(f"/proc/{pid}/io") as f:
+                for line in f:
+                    if line.startswith("write_bytes:"):
+                        write_bytes = int(line.split()[1])
+        except OSError:
+            pass
+        return rss, cpu, write_bytes
+
+    @classmethod
+    def read_trees(cls, pids: List[int]) -> Dict[int, Tuple[int, float, int]]:
+        """(rss, cpu, write_bytes) summed over each pid's process tree; touches only /proc."""
+        children = cls._children()
+        readings = {}
+        for pid in pids:
+            tree, rss, cpu, written = [pid], 0, 0.0, 0
+            while tree:
+                current = tree.pop()
+                tree.extend(children.get(current, []))
+                try:
+                    usage = cls._read_usage(current)
+                except (OSError, IndexError, ValueError):
+                    continue
+                rss, cpu, written = rss + usage[0], cpu + usage[1], written + usage[2]
+            readings[pid] = (rss, cpu, written)
+        return readings
+
+    def sample(self, readings: Dict[int, Tuple[int, float, int]]):
+        """Apply a read_trees result; processes unregistered since the read are skipped."""
+        for pid, (rss, cpu, written) in readings.items():
+            proc = self.processes.get(pid)
+            if proc is None:
+                continue
+            proc.update(rss=rss, peak_rss=max(proc["peak_rss"], rss), cpu=max(proc["cpu"], cpu),
+                        write_bytes=max(proc["write_bytes"], written))
+            self._publish(proc["job_id"])
+            if self.max_rss and rss > self.max_rss:
+                self.kill(pid, proc, f"RSS {rss // (1024 * 1024)} MB over the {self.max_rss // (1024 * 1024)} MB limit")
+
+    def kill(self, pid: int, proc: Dict, reason: str):
+        logger.error(f"Killing runaway process group {pid} ({proc['job_id']}): {reason}")
+        try:
+            os.killpg(os.getpgid(pid), signal.SIGKILL)
+        except ProcessLookupError:
+            return
+        metrics["processes_killed"] += 1
+        job = job_status.get(proc["job_id"])
+        if job is not None:
+            job["killed"] = reason
+
+    def _publish(self, job_id: str):
+        job = job_status.get(job_id)
+        if job is None:
+            return
+        live = [p for p in self.processes.values() if p["job_id"] == job_id]
+        usage = job.setdefault("usage", {"peak_rss": 0, "cpu": 0.0, "write_bytes": 0, "finished_cpu": 0.0,
+                                         "finished_write_bytes": 0})
+        usage["rss"] = sum(p["rss"] for p in live)
+        usage["peak_rss"] = max(usage["peak_rss"], usage["rss"])
+        usage["cpu"] = usage["finished_cpu"] + sum(p["cpu"] for p in live)
+        usage["write_bytes"] = usage["finished_write_bytes"] + sum(p["write_bytes"] for p in live)
+        usage["processes"] = len(live)
+
+    def _fold(self, proc: Dict):
+        """Move a finished process's totals into its job and the global metrics."""
+        metrics["cpu_seconds"] += proc["cpu"]
+        metrics["bytes_written"] += proc["write_bytes"]
+        job = job_status.get(proc["job_id"])
+        if job is None:
+            return
+        self._publish(proc["job_id"])  # Refresh the live totals without this process
+        usage = job["usage"]
+        usage["finished_cpu"] += proc["cpu"]
+        usage["finished_write_bytes"] += proc["write_bytes"]
+        usage["peak_rss"] = max(usage["peak_rss"], proc["peak_rss"])
+        self._publish(proc["job_id"])
+
+    def charge(self, job_id: str, cpu: float, write_bytes: int, peak_rss: int):
+        """Add what a shared process (an ingest) used during a job's window to the job's totals."""
+        job = job_status.get(job_id)
+        if job is None:
+            return
+        self._publish(job_id)
+        usage = job["usage"]
+        usage["finished_cpu"] += cpu
+        usage["finished_write_bytes"] += write_bytes
+        usage["peak_rss"] = max(usage["peak_rss"], peak_rss)
+        self._publish(job_id)
+
+    async def _run(self):
+        while True:
+            try:
+                self.sample(await asyncio.to_thread(self.read_trees, list(self.processes)))
+            except Exception as e:
+                logger.error(f"Process sampling failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+process_tracker = ProcessTracker(Config.PROCESS_SAMPLE_INTERVAL, Config.JOB_MAX_RSS_MB, Config.JOB_CGROUP_ROOT)
+
+class RecordingCatalog:
+    """SQLite catalog of finished recordings and the Telegram file_id each was uploaded as.
+
+    A request whose (link, variant) window is already covered by a stored
+    recording is answered with a file_id send instead of a new upload.
+    """
+
+    def __init__(self, path: str, tolerance: float):
+        self.path = path
+        self.tolerance = tolerance
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS recordings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    link TEXT NOT NULL,
+                    variant TEXT NOT NULL,
+                    start_ts REAL NOT NULL,
+                    end_ts REAL NOT NULL,
+                    title TEXT,
+                    channel TEXT,
+                    metadata TEXT,
+                    file_id TEXT NOT NULL,
+                    file_unique_id TEXT,
+                    file_size INTEGER,
+                    chat_id INTEGER,
+                    message_id INTEGER,
+                    created REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS recordings_window ON recordings (link, variant, start_ts);
+            """)
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = (), lastrowid: bool = False):
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(sql, params)
+                return cursor.lastrowid if lastrowid else cursor.fetchall()
+
+    def lock(self, link: str, variant: str) -> asyncio.Lock:
+        """Serializes lookup-then-upload per variant so concurrent duplicates reuse the first upload."""
+        return self._locks.setdefault((link, variant), asyncio.Lock())
+
+    async def add(self, link: str, variant: str, start_ts: float, end_ts: float, title: str, channel: str,
+                  metadata: Dict, message) -> int:
+        media = message.video or message.audio or message.document
+
+        def insert():
+            return self._execute(
+                "INSERT INTO recordings (link, variant, start_ts, end_ts, title, channel, metadata, file_id, "
+                "file_unique_id, file_size, chat_id, message_id, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (link, variant, start_ts, end_ts, title, channel, json.dumps(metadata), media.file_id,
+                 media.file_unique_id, media.file_size, message.chat.id, message.id, time.time()),
+                lastrowid=True,
+            )
+
+        return await asyncio.to_thread(insert)
+
+    async def find_covering(self, link: str, variant: str, start_ts: float, end_ts: float):
+        """Shortest stored recording of this variant that covers [start_ts, end_ts] within the tolerance."""
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT * FROM recordings WHERE link = ? AND variant = ? AND start_ts <= ? AND end_ts >= ? "
+            "ORDER BY end_ts - start_ts LIMIT 1",
+            (link, variant, start_ts + self.tolerance, end_ts - self.tolerance),
+        )
+        return rows[0] if rows else None
+
+    async def get(self, recording_id: int):
+        rows = await asyncio.to_thread(self._execute, "SELECT * FROM recordings WHERE id = ?", (recording_id,))
+        return rows[0] if rows else None
+
+    async def page(self, offset: int, limit: int, query: str = "") -> Tuple[List[sqlite3.Row], int]:
+        pattern = f"%{query}%"
+        where = "WHERE title LIKE ? OR channel LIKE ?" if query else ""
+        params = (pattern, pattern) if query else ()
+        rows = await asyncio.to_thread(
+            self._execute, f"SELECT * FROM recordings {where} ORDER BY start_ts DESC LIMIT ? OFFSET ?",
+            params + (limit, offset),
+        )
+        total = await asyncio.to_thread(self._execute, f"SELECT COUNT(*) FROM recordings {where}", params)
+        return rows, total[0][0]
+
+recording_catalog = RecordingCatalog(Config.RECORDINGS_DB, Config.RECORDING_MATCH_TOLERANCE)
+
+class UploadProgress:
+    """Progress callback that edits one status message at most every `interval` seconds."""
+
+    def __init__(self, message: Message, label: str, interval: float):
+        self.message = message
+        self.label = label
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_edit = 0.0
+
+    async def update(self, current: int, total: int):
+        now = time.monotonic()
+        if current < total and now - self.last_edit < self.interval:
+            return
+        self.last_edit = now
+        speed = current / max(now - self.started, 1e-6)
+        try:
+            await self.message.edit_text(
+                f"Uploading {self.label}: {current * 100 / total:.0f}% "
+                f"({current / 1024 ** 2:.0f} / {total / 1024 ** 2:.0f} MB) at {speed / 1024 ** 2:.1f} MB/s"
+            )
+        except Exception as e:
+            logger.debug(f"Progress edit skipped: {e}")
+
+class UploadEngine:
+    """Bounds how many files upload at once and keeps upload throughput statistics."""
+
+    def __init__(self, max_files: int, progress_interval: float):
+        self.slots = asyncio.Semaphore(max_files)
+        self.progress_interval = progress_interval
+        self.active = 0
+        self.bytes_uploaded = 0
+        self.seconds_uploading = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Average upload speed in bytes per second."""
+        return self.bytes_uploaded / self.seconds_uploading if self.seconds_uploading else 0.0
+
+    async def send_video(self, client: Client, chat_id: int, path: str, caption: str, notify_chat: int = None):
+        return await self._send(client, path, notify_chat, lambda progress: client.send_video(
+            chat_id=chat_id, video=path, caption=caption, supports_streaming=True, progress=progress,
+        ))
+
+    async def send_audio(self, client: Client, chat_id: int, path: str, caption: str, notify_chat: int = None,
+                         title: str = None, performer: str = None):
+        return await self._send(client, path, notify_chat, lambda progress: client.send_audio(
+            chat_id=chat_id, audio=path, caption=caption, title=title, performer=performer, progress=progress,
+        ))
+
+    async def _send(self, client: Client, path: str, notify_chat: int, send):
+        async with self.slots:
+            self.active += 1
+            progress = None
+            if notify_chat is not None:
+                try:
+                    status = await bot.send_message(notify_chat, f"Uploading {os.path.basename(path)}...")
+                    progress = UploadProgress(status, os.path.basename(path), self.progress_interval)
+                except Exception as e:
+                    logger.warning(f"Could not post upload progress: {e}")
+            started = time.monotonic()
+            try:
+                message = await send(progress.update if progress else None)
+            finally:
+                self.active -= 1
+            self.seconds_uploading += time.monotonic() - started
+            self.bytes_uploaded += os.path.getsize(path)
+            metrics["uploads"] += 1
+            metrics[f"uploads_{client.name}"] += 1
+            return message
+
+upload_engine = UploadEngine(Config.MAX_CONCURRENT_UPLOADS, Config.UPLOAD_PROGRESS_INTERVAL)
+
+class JobJournal:
+    """Write-ahead log of job stage transitions (created, captured, uploaded, fanned_out, done).
+
+    Every record is appended and fsync'd before the stage is acted on as
+    complete, so after a crash `replay` knows exactly which uploads and
+    dump-chat copies already happened. The file is compacted down to the
+    unfinished jobs at startup and whenever a job is done, so it stays
+    bounded by the jobs in flight.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = asyncio.Lock()
+
+    def _append(self, line: str):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def record(self, job_id: str, stage: str, **data):
+        line = json.dumps({"job_id": job_id, "stage": stage, "ts": time.time(), **data})
+        async with self._lock:
+            await asyncio.to_thread(self._append, line)
+            if stage == "done":
+                await asyncio.to_thread(self._replay)  # Compact the finished job's history away
+
+    def _replay(self) -> Dict[str, Dict]:
+        """Rebuild the unfinished jobs and rewrite the file with only their records."""
+        jobs: Dict[str, Dict] = {}
+        records: Dict[str, List[str]] = defaultdict(list)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return jobs
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Torn final write
+            job_id, stage = entry.pop("job_id"), entry.pop("stage")
+            records[job_id].append(line.rstrip("\n"))
+            if stage == "created":
+                entry["started"] = entry.pop("ts")
+                jobs[job_id] = {**entry, "pairs": [tuple(pair) for pair in entry["pairs"]],
+                                "files": [], "uploaded": {}, "fanned_out": {}}
+            elif job_id not in jobs:
+                continue
+            elif stage == "captured":
+                jobs[job_id]["files"] = entry["files"]
+                if "pairs" in entry:
+                    jobs[job_id]["pairs"] = [tuple(pair) for pair in entry["pairs"]]
+                jobs[job_id]["integrity"] = entry.get("integrity", {})
+            elif stage == "uploaded":
+                jobs[job_id]["uploaded"][entry["file"]] = {"chat_id": entry["chat_id"], "message_id": entry["message_id"]}
+            elif stage == "fanned_out":
+                jobs[job_id]["fanned_out"].setdefault(entry["file"], []).append(entry["chat_id"])
+            elif stage == "done":
+                del jobs[job_id]
+
+        # Compact: keep only the history of unfinished jobs
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for job_id in jobs:
+                f.write("\n".join(records[job_id]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return jobs
+
+    async def replay(self) -> Dict[str, Dict]:
+        async with self._lock:
+            return await asyncio.to_thread(self._replay)
+
+job_journal = JobJournal(Config.JOB_JOURNAL)
+
+def format_usage(usage: Dict) -> str:
+    return (f"peak RSS {usage.get('peak_rss', 0) / (1024 * 1024):.0f} MB, "
+            f"CPU {usage.get('cpu', 0):.0f}s, written {usage.get('write_bytes', 0) / (1024 * 1024):.0f} MB")
+
+# Job lists for batch_document; like commands they must get past the private-message catch-all below
+job_list_document = filters.document & filters.create(
+    lambda _, __, message: (message.document.file_name or "").lower().endswith((".jsonl", ".csv"))
+)
 
-@bot.on_message(filters.private)  # Only respond to private messages
+# Commands are left to their own handlers, including those registered after this one
+@bot.on_message(filters.private & ~filters.regex(r"^/") & ~job_list_document)  # Only respond to private messages
 async def handle_private_message(client, message):
     user_id = message.from_user.id  # Get the user ID of the sender
 
@@ -61,17 +798,126 @@ async def handle_private_message(client, message):
     # If the user is authorized, handle the command or message
     await message.reply("</code> Welcome! You Have Acces To Use The Bot. To Live Record Bot! Use /record <link> <hh:mm:ss> to start recording. </code>")
 
-# Helper: Run shell commands asynchronously
-async def run_command(cmd: str) -> Tuple[str, str]:
-    logger.info(f"Executing command: {cmd}")
-    process = await asyncio.create_subprocess_shell(
-        cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+class CommandStalled(Exception):
+    """Raised by run_command when the watchdog killed a job that stopped making progress."""
+
+    def __init__(self, cmd: List[str], stdout: str, stderr: str):
+        super().__init__(f"No progress from: {shlex.join(cmd)}")
+        self.stdout = stdout
+        self.stderr = stderr
+
+class ReapedProcess:
+    """A child process reaped with os.wait4 on a thread of its own, so its rusage outlives it.
+
+    Offers the parts of asyncio's Process that run_command uses (pid,
+    returncode, stdout/stderr readers, wait()); asyncio's child watcher
+    would reap the child with waitpid and discard its resource usage.
+    """
+
+    def __init__(self, cmd: List[str]):
+        self.popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                      start_new_session=True)
+        self.pid = self.popen.pid
+        apply_job_rlimits(self.pid)
+        self.returncode = None
+        self.rusage = None
+        self.stdout = self.stderr = None
+        self._loop = asyncio.get_running_loop()
+        self._exited = self._loop.create_future()
+        threading.Thread(target=self._reap, name=f"reap-{self.pid}", daemon=True).start()
+
+    async def connect_pipes(self):
+        for name in ("stdout", "stderr"):
+            reader = asyncio.StreamReader()
+            await self._loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), getattr(self.popen, name))
+            setattr(self, name, reader)
+
+    def _reap(self):
+        _, status, rusage = os.wait4(self.pid, 0)
+        try:
+            self._loop.call_soon_threadsafe(self._exited.set_result, (os.waitstatus_to_exitcode(status), rusage))
+        except RuntimeError:
+            pass  # Loop already closed
+
+    async def wait(self) -> int:
+        if self.returncode is None:
+            self.returncode, self.rusage = await asyncio.shield(self._exited)
+            self.popen.returncode = self.returncode  # Already reaped; keep Popen from waiting on it again
+        return self.returncode
+
+async def terminate_process(process, grace: float = 5):
+    """SIGTERM the process group (ffmpeg finalizes its output), SIGKILL it after `grace`, then reap."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)  # start_new_session makes the pid the group id
+        except ProcessLookupError:
+            break
+        try:
+            await asyncio.wait_for(process.wait(), timeout=grace)
+            return
+        except asyncio.TimeoutError:
+            continue
+    await process.wait()
+
+PIPE_CHUNK_BYTES = 64 * 1024
+OUTPUT_TAIL_BYTES = 1024 * 1024
+
+# Helper: Run commands asynchronously (exec, no shell) under a progress watchdog
+async def run_command(cmd: List[str], job_id: str = None, progress_file: str = None,
+                      stall_timeout: float = None, deadline: float = None) -> Tuple[str, str]:
+    """Run `cmd` and return (stdout, stderr).
+
+    Progress is growth of `progress_file` when given, otherwise any output
+    on the pipes. No progress for `stall_timeout` seconds raises
+    CommandStalled; running past `deadline` seconds terminates the job and
+    returns what it produced. Only the tail of each pipe (at most
+    OUTPUT_TAIL_BYTES) is kept, so a capture running for hours holds bounded memory.
+    """
+    logger.info(f"Executing command: {shlex.join(cmd)}")
+    process = ReapedProcess(cmd)
+    process_tracker.register(process.pid, job_id, shlex.join(cmd))
+    stdout_chunks = deque(maxlen=OUTPUT_TAIL_BYTES // PIPE_CHUNK_BYTES)
+    stderr_chunks = deque(maxlen=OUTPUT_TAIL_BYTES // PIPE_CHUNK_BYTES)
+    started = last_progress = time.monotonic()
+    last_size = -1
+    stalled = False
+
+    async def drain(stream, chunks):
+        nonlocal last_progress
+        while data := await stream.read(PIPE_CHUNK_BYTES):
+            chunks.append(data)
+            if progress_file is None:
+                last_progress = time.monotonic()
 
-    stdout, stderr = await process.communicate()
-    return stdout.decode(), stderr.decode()
+    try:
+        await process.connect_pipes()
+        readers = asyncio.gather(drain(process.stdout, stdout_chunks), drain(process.stderr, stderr_chunks))
+        waiter = asyncio.ensure_future(process.wait())
+        while not waiter.done():
+            await asyncio.wait({waiter}, timeout=1)
+            now = time.monotonic()
+            if progress_file and os.path.exists(progress_file):
+                size = os.path.getsize(progress_file)
+                if size != last_size:
+                    last_size, last_progress = size, now
+            if stall_timeout and now - last_progress > stall_timeout and not waiter.done():
+                logger.warning(f"No progress for {stall_timeout}s, killing pid {process.pid} ({job_id})")
+                stalled = True
+                await terminate_process(process)
+            elif deadline and now - started > deadline and not waiter.done():
+                logger.warning(f"Deadline of {deadline:.0f}s passed, terminating pid {process.pid} ({job_id})")
+                await terminate_process(process)
+        await readers
+    finally:
+        if process.returncode is None:
+            await terminate_process(process)
+        process_tracker.unregister(process.pid, process.rusage)
+
+    stdout, stderr = b"".join(stdout_chunks).decode(errors="replace"), b"".join(stderr_chunks).decode(errors="replace")
+    if stalled:
+        metrics["stalls"] += 1
+        raise CommandStalled(cmd, stdout, stderr)
+    return stdout, stderr
 
 async def parse_streams(link: str) -> Tuple[List[str], List[str], List[str]]:
     ydl_opts = {
@@ -85,6 +931,7 @@ async def parse_streams(link: str) -> Tuple[List[str], List[str], List[str]]:
     video_streams = []
     audio_video_streams = []  # For multiplexed audio-video streams
     seen_audio_codecs = set()  # To avoid duplicate audio codec listings
+    formats = {"audio": [], "video": [], "multiplexed": []}
 
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         try:
@@ -105,6 +952,7 @@ async def parse_streams(link: str) -> Tuple[List[str], List[str], List[str]]:
                     video_streams.append(
                         f"{stream['format_id']} - {resolution} - {stream.get('vcodec', 'Unknown')} - {video_bitrate}"
                     )
+                    formats["video"].append(stream)
 
                 # Audio-only streams
                 elif stream.get('acodec') != 'none' and stream.get('vcodec') == 'none':
@@ -112,6 +960,7 @@ async def parse_streams(link: str) -> Tuple[List[str], List[str], List[str]]:
                     audio_streams.append(
                         f"{stream['format_id']} - {stream.get('acodec', 'Default')} - {stream.get('language', 'Track')} - {audio_bitrate}"
                     )
+                    formats["audio"].append(stream)
 
                 # Multiplexed streams (audio + video)
                 elif stream.get('vcodec') != 'none' and stream.get('acodec') != 'none':
@@ -130,12 +979,17 @@ async def parse_streams(link: str) -> Tuple[List[str], List[str], List[str]]:
                         )
                         audio_streams.append(f"{stream['format_id']} - {language} - {audio_codec} - {audio_bitrate}")
                         video_streams.append(f"{stream['format_id']} - {resolution} - {video_codec} - {video_bitrate}")
+                        formats["multiplexed"].append(stream)
+                        formats["audio"].append(stream)
+                        formats["video"].append(stream)
                     else:
                         # If the audio codec is the same, just append the video part with no audio description
                         audio_video_streams.append(
                             f"{stream['format_id']} - {resolution} - {video_codec} ({video_bitrate})"
                         )
                         video_streams.append(f"{stream['format_id']} - {resolution} - {video_codec} - {video_bitrate}")
+                        formats["multiplexed"].append(stream)
+                        formats["video"].append(stream)
 
                 # Catch-all else clause for unknown formats
                 else:
@@ -155,22 +1009,138 @@ async def parse_streams(link: str) -> Tuple[List[str], List[str], List[str]]:
                 logger.error("No valid video or audio streams found.")
                 return [], [], []
 
+            stream_formats[link] = formats
+            stream_probed[link] = time.time()
+
         except Exception as e:
             logger.error(f"Error occurred while parsing streams: {e}")
             return [], [], []
 
     return audio_streams, video_streams, audio_video_streams
 
-# Helper: Create inline buttons for stream selection
-def create_buttons(items: List[str], selected: set, prefix: str) -> InlineKeyboardMarkup:
+async def refresh_stream_formats(link: str, pairs: List[Tuple] = ()) -> List[Tuple]:
+    """Re-probe `link` unless it was probed in the last FORMATS_MAX_AGE seconds; return `pairs` remapped.
+
+    Format URLs often carry expiring tokens, so a capture must not start from
+    an old probe. The (video, audio) index pairs are moved onto the new
+    format lists by format_id; a track that vanished keeps its index.
+    """
+    if time.time() - stream_probed.get(link, 0) < Config.FORMATS_MAX_AGE:
+        return list(pairs)
+    old = stream_formats.get(link, {})
+
+    def format_id(formats: Dict, kind: str, idx: int):
+        entries = formats.get(kind, [])
+        return entries[idx].get("format_id") if idx is not None and idx < len(entries) else None
+
+    wanted = [(format_id(old, "video", video), format_id(old, "audio", audio)) for video, audio in pairs]
+    await parse_streams(link)
+    new = stream_formats.get(link, {})
+
+    def remap(kind: str, wanted_id, idx: int):
+        ids = [fmt.get("format_id") for fmt in new.get(kind, [])]
+        return ids.index(wanted_id) if wanted_id is not None and wanted_id in ids else idx
+
+    return [(remap("video", video_id, video), remap("audio", audio_id, audio))
+            for (video_id, audio_id), (video, audio) in zip(wanted, pairs)]
+
+def is_muxed(fmt: dict) -> bool:
+    """Whether a format carries audio and video in one playlist."""
+    return fmt.get("acodec") not in (None, "none") and fmt.get("vcodec") not in (None, "none")
+
+def audio_only_indices(link: str) -> List[int]:
+    """Indices into the audio list of renditions without video; the list also holds multiplexed formats."""
+    return [i for i, fmt in enumerate(stream_formats.get(link, {}).get("audio", [])) if fmt.get("vcodec") == "none"]
+
+def rank_video_formats(link: str) -> List[Tuple[int, dict]]:
+    """Return (index, format) pairs of the video list, best resolution/bitrate first."""
+    video_formats = stream_formats.get(link, {}).get("video", [])
+    return sorted(
+        enumerate(video_formats),
+        key=lambda item: (item[1].get("height") or 0, item[1].get("tbr") or 0),
+        reverse=True,
+    )
+
+async def probe_realtime_factor(fmt: dict, extra_kbps: float = 0) -> float:
+    """Measure how many seconds of this format (plus `extra_kbps` of audio) download per second."""
+    bitrate = fmt.get("tbr") or 0
+    try:
+        factor = await asyncio.to_thread(
+            measure_throughput, fmt["url"], Config.AUTO_PROBE_SEGMENTS, bitrate or None
+        )
+    except Exception as e:
+        logger.warning(f"Bandwidth probe failed for format {fmt.get('format_id')}: {e}")
+        return 0.0
+    if bitrate:
+        origin_governor.observe(fmt["url"], factor * bitrate)
+    # A separate audio rendition shares the same pipe, so scale by the combined bitrate
+    if bitrate and extra_kbps:
+        factor *= bitrate / (bitrate + extra_kbps)
+    return factor
+
+async def auto_select_streams(link: str) -> Tuple[set, set, float]:
+    """Pick the best audio track and the highest video variant that keeps up with realtime.
+
+    A muxed variant brings its own audio: the audio selection is then {None},
+    so the capture opens that one playlist instead of a second A/V variant.
+    """
+    formats = stream_formats.get(link, {})
+    audio_formats = formats.get("audio", [])
+    ranked = rank_video_formats(link)
+    if not ranked:
+        return set(), set(), 0.0
+
+    candidates = audio_only_indices(link) or range(len(audio_formats))
+    audio_idx = max(candidates, key=lambda i: audio_formats[i].get("abr") or 0, default=None)
+    factor = 0.0
+    for video_idx, video_fmt in ranked:
+        if not is_muxed(video_fmt) and audio_idx is None:
+            continue  # Video-only variant and no audio to pair it with
+        extra_kbps = 0 if is_muxed(video_fmt) else (audio_formats[audio_idx].get("abr") or 0)
+        factor = await probe_realtime_factor(video_fmt, extra_kbps)
+        logger.info(f"Auto-select probe: format {video_fmt.get('format_id')} sustains {factor:.2f}x realtime")
+        if factor >= Config.AUTO_SELECT_MIN_REALTIME:
+            return {None if is_muxed(video_fmt) else audio_idx}, {video_idx}, factor
+
+    # Nothing sustains the target; fall back to the lightest usable variant
+    usable = [(idx, fmt) for idx, fmt in ranked if is_muxed(fmt) or audio_idx is not None]
+    if not usable:
+        return set(), set(), 0.0
+    video_idx, video_fmt = usable[-1]
+    return {None if is_muxed(video_fmt) else audio_idx}, {video_idx}, factor
+
+# Helper: Shorten a parse_streams entry to fit a button
+def compact_label(item: str) -> str:
+    label = re.sub(r"(\b[a-z0-9]{3,4})\.[0-9a-fA-F.]+", r"\1", item)  # avc1.64001f -> avc1
+    label = label.replace("kbps", "k").replace(" - ", " · ")
+    return label if len(label) <= BUTTON_LABEL_LENGTH else label[:BUTTON_LABEL_LENGTH - 1] + "…"
+
+@lru_cache(maxsize=1024)
+def render_buttons(items: Tuple[str, ...], selection: int, prefix: str, page: int) -> InlineKeyboardMarkup:
+    """Render one keyboard page; cached per (probe result, selection bitset, page)."""
+    pages = max((len(items) + BUTTONS_PER_PAGE - 1) // BUTTONS_PER_PAGE, 1)
+    start = page * BUTTONS_PER_PAGE
     buttons = [
         InlineKeyboardButton(
-            f"{'✔' if i in selected else ''} {item}",
+            f"{'✔ ' if selection >> i & 1 else ''}{compact_label(items[i])}",
             callback_data=f"{prefix}_{i}"
-        ) for i, item in enumerate(items)
+        ) for i in range(start, min(start + BUTTONS_PER_PAGE, len(items)))
     ]
-    buttons.append(InlineKeyboardButton("✅ Confirm", callback_data=f"{prefix}_confirm"))
-    return InlineKeyboardMarkup([buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+    rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    if pages > 1:
+        rows.append([
+            InlineKeyboardButton("⬅️", callback_data=f"{prefix}_p{(page - 1) % pages}"),
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"{prefix}_p{page}"),
+            InlineKeyboardButton("➡️", callback_data=f"{prefix}_p{(page + 1) % pages}"),
+        ])
+    rows.append([InlineKeyboardButton("✅ Confirm", callback_data=f"{prefix}_confirm")])
+    return InlineKeyboardMarkup(rows)
+
+# Helper: Create inline buttons for stream selection
+def create_buttons(items: List[str], selected: set, prefix: str, page: int = 0) -> InlineKeyboardMarkup:
+    pages = max((len(items) + BUTTONS_PER_PAGE - 1) // BUTTONS_PER_PAGE, 1)
+    selection = sum(1 << i for i in selected)
+    return render_buttons(tuple(items), selection, prefix, min(max(page, 0), pages - 1))
 
 # Helper: Split and send long messages
 async def send_long_message(chat_id: int, text: str):
@@ -182,20 +1152,600 @@ async def send_long_message(chat_id: int, text: str):
 async def start_command(_, message: Message):
     await message.reply_text("</code> Welcome! You Have Acces To Use The Bot. To Live Record Bot! Use /record <link> <hh:mm:ss> to start recording. </code>")
 
+# Helper: Render one page of channel search results
+def render_channel_page(query: str, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    results = channel_index.search(query)
+    pages = max((len(results) + CHANNELS_PER_PAGE - 1) // CHANNELS_PER_PAGE, 1)
+    page = min(max(page, 0), pages - 1)
+    chunk = results[page * CHANNELS_PER_PAGE:(page + 1) * CHANNELS_PER_PAGE]
+    header = f"Channels matching <code>{html.escape(query)}</code>" if query else "Available Channels"
+    lines = "\n".join(f"• <code>{html.escape(name)}</code>" for name in chunk) or "No channels found."
+    text = f"{header} ({len(results)}) - page {page + 1}/{pages}:\n\n{lines}"
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"chpage_{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"chpage_{page + 1}"))
+    return text[:MAX_MESSAGE_LENGTH], InlineKeyboardMarkup([nav]) if nav else None
+
+# Command: Channels
+@bot.on_message(filters.command("channels") & filters.user(Config.AUTH_USERS))
+async def channels_command(_, message: Message):
+    if not len(channel_index):
+        await message.reply_text("Channel list is not available yet, please try again shortly.")
+        return
+    query = message.text.split(maxsplit=1)[1].strip() if len(message.command) > 1 else ""
+    channel_queries[message.from_user.id] = query
+    text, buttons = render_channel_page(query, 0)
+    await message.reply_text(text, reply_markup=buttons)
+
+# Callback: Page through /channels results
+@bot.on_callback_query(filters.regex(r"^chpage_(\d+)$"))
+async def channels_page(_, query: CallbackQuery):
+    text, buttons = render_channel_page(channel_queries.get(query.from_user.id, ""), int(query.matches[0].group(1)))
+    await query.message.edit_text(text, reply_markup=buttons)
+
+# Inline query: Channel autocomplete
+@bot.on_inline_query(filters.user(Config.AUTH_USERS))
+async def channels_inline(_, inline_query: InlineQuery):
+    results = [
+        InlineQueryResultArticle(
+            title=name,
+            description=link,
+            input_message_content=InputTextMessageContent(f"<b>{html.escape(name)}</b>\n<code>{html.escape(link)}</code>"),
+        )
+        for name, link in channel_index.search_links(inline_query.query, limit=50)
+    ]
+    await inline_query.answer(results, cache_time=60)
+
+# Helper: Render one page of the recordings catalog
+RECORDINGS_PER_PAGE = 8
+
+async def render_recordings_page(query: str, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    rows, total = await recording_catalog.page(page * RECORDINGS_PER_PAGE, RECORDINGS_PER_PAGE, query)
+    pages = max((total + RECORDINGS_PER_PAGE - 1) // RECORDINGS_PER_PAGE, 1)
+    lines = []
+    buttons = []
+    for row in rows:
+        started = datetime.fromtimestamp(row["start_ts"]).strftime("%d %b %H:%M")
+        minutes = (row["end_ts"] - row["start_ts"]) / 60
+        lines.append(f"<b>#{row['id']}</b> {html.escape(str(row['title']))} · {html.escape(str(row['channel']))} · {started} · {minutes:.0f} min")
+        buttons.append(InlineKeyboardButton(f"📤 #{row['id']}", callback_data=f"rec_send_{row['id']}"))
+    rows_markup = [buttons[i:i + 4] for i in range(0, len(buttons), 4)]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"rec_page_{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"rec_page_{page + 1}"))
+    if nav:
+        rows_markup.append(nav)
+    text = f"Recordings ({total}) - page {page + 1}/{pages}:\n\n" + ("\n".join(lines) or "No recordings yet.")
+    return text, InlineKeyboardMarkup(rows_markup) if rows_markup else None
+
+# Command: Recordings
+@bot.on_message(filters.command("recordings") & filters.user(Config.AUTH_USERS))
+async def recordings_command(_, message: Message):
+    query = message.text.split(maxsplit=1)[1].strip() if len(message.command) > 1 else ""
+    user_sessions.setdefault(message.from_user.id, {})["recordings_query"] = query
+    text, buttons = await render_recordings_page(query, 0)
+    await message.reply_text(text, reply_markup=buttons)
+
+# Callback: Page through recordings or re-send one by copying its stored message
+@bot.on_callback_query(filters.regex(r"^rec_(page|send)_(\d+)$"))
+async def recordings_callback(_, query: CallbackQuery):
+    action, value = query.matches[0].group(1), int(query.matches[0].group(2))
+    if action == "page":
+        text, buttons = await render_recordings_page(
+            user_sessions.get(query.from_user.id, {}).get("recordings_query", ""), value
+        )
+        await query.message.edit_text(text, reply_markup=buttons)
+        return
+    row = await recording_catalog.get(value)
+    if not row:
+        await query.answer("Recording not found.", show_alert=True)
+        return
+    # The primary bot can message the user and read the store chat; it works for audio and video alike
+    try:
+        await bot.copy_message(query.message.chat.id, row["chat_id"], row["message_id"])
+    except Exception as e:
+        logger.error(f"Could not re-send recording #{value}: {e}")
+        await query.answer("Could not send this recording.", show_alert=True)
+        return
+    metrics["file_id_reuses"] += 1
+    await query.answer("Sent.")
+
+# Command: Upload benchmark (owner only)
+@bot.on_message(filters.command("uploadbench") & filters.user(Config.OWNER_ID))
+async def upload_benchmark(client, message: Message):
+    """Measure raw part-upload throughput for a range of part concurrencies."""
+    size_mb = int(message.command[1]) if len(message.command) > 1 and message.command[1].isdigit() else 64
+    concurrencies = [int(x) for x in message.command[2:] if x.isdigit()] or [1, 2, 4, 8, 16]
+    path = os.path.join(DOWNLOADS_DIR, "uploadbench.bin")
+
+    def write_test_file():
+        with open(path, "wb") as f:
+            f.write(os.urandom(size_mb * 1024 * 1024))
+
+    await asyncio.to_thread(write_test_file)
+    status = await message.reply_text(f"Benchmarking a {size_mb} MB upload at part concurrency {concurrencies}...")
+    results = []
+    try:
+        for workers in concurrencies:
+            started = time.monotonic()
+            try:
+                await client.save_file(path, part_workers=workers)
+                elapsed = time.monotonic() - started
+                results.append(f"{workers:>3} parts: {size_mb / elapsed:6.2f} MB/s ({elapsed:.1f}s)")
+            except Exception as e:
+                results.append(f"{workers:>3} parts: failed ({e})")
+            await status.edit_text("Upload benchmark:\n<code>" + "\n".join(results) + "</code>")
+    finally:
+        os.remove(path)
+
+class EPGRules:
+    """Auto-record rules ("every programme matching X on channel Y"), persisted as JSON."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rules: List[Dict] = []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.rules = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable EPG rules {path}: {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.rules, f)
+        os.replace(tmp_path, self.path)
+
+    async def add(self, user_id: int, channel: str, pattern: str, audio_only: bool) -> Dict:
+        rule = {"id": max((rule["id"] for rule in self.rules), default=0) + 1, "user_id": user_id,
+                "channel": channel, "pattern": pattern, "audio_only": audio_only}
+        self.rules.append(rule)
+        await asyncio.to_thread(self._save)
+        return rule
+
+    async def remove(self, user_id: int, rule_id: int) -> bool:
+        kept = [rule for rule in self.rules if not (rule["id"] == rule_id and rule["user_id"] == user_id)]
+        if len(kept) == len(self.rules):
+            return False
+        self.rules = kept
+        await asyncio.to_thread(self._save)
+        return True
+
+epg_rules = EPGRules(Config.EPG_RULES_PATH)
+
+def next_epg_match(rule: Dict, days: int = 14):
+    """Next programme (not yet ended) matching a rule, or None."""
+    pattern = re.compile(rule["pattern"], re.IGNORECASE)
+    now = time.time()
+    return next((programme for programme in epg_index.overlapping(rule["channel"], now, now + days * 86400)
+                 if pattern.search(programme["title"])), None)
+
+# Command: Auto-record programmes from the EPG
+@bot.on_message(filters.command("autorecord") & filters.user(Config.AUTH_USERS))
+async def autorecord_command(_, message: Message):
+    """/autorecord <channel> | <title regex> [| audio], /autorecord del <id>, or /autorecord to list."""
+    user_id = message.from_user.id
+    text = message.text.split(maxsplit=1)[1].strip() if len(message.command) > 1 else ""
+
+    if not text:
+        rules = [rule for rule in epg_rules.rules if rule["user_id"] == user_id]
+        if not rules:
+            await message.reply_text("No auto-record rules. Add one with /autorecord <channel> | <title regex> [| audio]")
+            return
+        lines = []
+        for rule in rules:
+            upcoming = next_epg_match(rule)
+            when = datetime.fromtimestamp(upcoming["start"]).strftime("%a %d %b %H:%M") if upcoming else "no match in guide"
+            lines.append(f"#{rule['id']} {rule['channel']} | {rule['pattern']}{' (audio)' if rule['audio_only'] else ''} -> {when}")
+        await message.reply_text("Auto-record rules:\n" + "\n".join(lines))
+        return
+
+    if message.command[1].lower() == "del":
+        if len(message.command) < 3 or not message.command[2].isdigit():
+            await message.reply_text("Use: /autorecord del <id>")
+        elif await epg_rules.remove(user_id, int(message.command[2])):
+            await message.reply_text(f"Removed rule #{message.command[2]}.")
+        else:
+            await message.reply_text(f"No rule #{message.command[2]}.")
+        return
+
+    parts = [part.strip() for part in text.split("|")]
+    if len(parts) not in (2, 3) or not parts[0] or not parts[1] or (len(parts) == 3 and parts[2].lower() != "audio"):
+        await message.reply_text("Invalid format! Use: /autorecord <channel> | <title regex> [| audio]")
+        return
+    channel, pattern = parts[0], parts[1]
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        await message.reply_text(f"Invalid title pattern: {e}")
+        return
+    if not channel_index.resolve(channel):
+        suggestions = ", ".join(channel_index.search(channel, limit=5)) or "none"
+        await message.reply_text(f"Unknown channel '{channel}'. Did you mean: {suggestions}")
+        return
+
+    rule = await epg_rules.add(user_id, channel, pattern, len(parts) == 3)
+    upcoming = next_epg_match(rule)
+    if channel not in epg_index:
+        note = "The guide has no programmes for this channel yet."
+    elif upcoming:
+        note = f"Next: {upcoming['title']} at {datetime.fromtimestamp(upcoming['start']).strftime('%a %d %b %H:%M')}."
+    else:
+        note = "Nothing in the current guide matches yet."
+    await message.reply_text(f"Added rule #{rule['id']}. {note}")
+
+def format_size(num_bytes: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+def format_eta(seconds: float) -> str:
+    seconds = max(int(seconds), 0)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def hit_rate(hits: float, misses: float) -> str:
+    total = hits + misses
+    return f"{hits / total * 100:.0f}% ({hits:.0f}/{total:.0f})" if total else "n/a"
+
+async def render_stats() -> str:
+    """One-message dashboard of jobs, ingests, delivery, disk, loop lag and caches."""
+    now = time.time()
+    ingests = {ingest.ingest_id: ingest for ingest in capture_registry.ingests.values()}
+    jobs = {job_id: job for job_id, job in job_status.items()
+            if not job_id.startswith("ingest-") and job.get("state") in ("capturing", "uploading")}
+
+    lines = [f"<b>Jobs:</b> {sum(job['state'] == 'capturing' for job in jobs.values())} capturing, "
+             f"{sum(job['state'] == 'uploading' for job in jobs.values())} uploading, "
+             f"{sum(origin_governor.waiting.values())} ingest(s) queued at origins"]
+    for job_id, job in sorted(jobs.items(), key=lambda item: item[1]["started"])[:10]:
+        if job["state"] == "capturing":
+            speeds = [ingests[ingest_id].realtime_factor() for ingest_id in job.get("ingests", []) if ingest_id in ingests]
+            speed = f"{min(speeds):.2f}x realtime" if speeds else "starting"
+            eta = format_eta(job["window_start"] + job["duration"] + Config.SYNC_CAPTURE_PADDING - now)
+        else:
+            speed = f"{job.get('pending', 0)} file(s) left"
+            left = sum(os.path.getsize(path) for path in job["files"] if path not in job["uploaded"] and os.path.exists(path))
+            eta = format_eta(left / upload_engine.throughput) if upload_engine.throughput else "?"
+        lines.append(f"<code>{job_id}</code> {html.escape(str(job.get('title')))}: {job['state']}, {speed}, ETA {eta}")
+
+    if ingests:
+        lines.append("<b>Ingests:</b>")
+    for ingest in ingests.values():
+        state = job_status.get(ingest.ingest_id, {}).get("state", "?")
+        lines.append(f"<code>{ingest.ingest_id}</code> {state}: {ingest.realtime_factor():.2f}x realtime, "
+                     f"{format_size(ingest.bytes_written)} written, {len(ingest.subscribers)} subscriber(s)")
+
+    depths = delivery_pipeline.depths()
+    lines.append("<b>Delivery:</b> " + ", ".join(f"{stage} {queued} queued/{busy} busy" for stage, (queued, busy) in depths.items()))
+    lines.append(f"<b>Upload:</b> {format_size(upload_engine.throughput)}/s average, {upload_engine.active} active, "
+                 f"{metrics['uploads']:.0f} file(s), {format_size(upload_engine.bytes_uploaded)} total")
+
+    used = await asyncio.to_thread(directory_size, DOWNLOADS_DIR)
+    disk = shutil.disk_usage(DOWNLOADS_DIR)
+    lines.append(f"<b>Disk:</b> {format_size(used)} in {DOWNLOADS_DIR}, {format_size(disk.free)} free of {format_size(disk.total)}")
+    lines.append(f"<b>Event loop lag:</b> {loop_lag.last * 1000:.0f} ms now, "
+                 f"{loop_lag.average * 1000:.0f} ms average, p99 ≤{loop_lag.percentile(99):.0f} ms, {loop_lag.max * 1000:.0f} ms max")
+
+    buttons = render_buttons.cache_info()
+    lines.append("<b>Caches:</b> buttons " + hit_rate(buttons.hits, buttons.misses)
+                 + ", file_id reuse " + hit_rate(metrics["file_id_reuses"], metrics["uploads"])
+                 + ", shared ingest " + hit_rate(metrics["shared_ingest_joins"], metrics["shared_ingest_starts"]))
+    if blocking_detector is not None:
+        worst = sorted(blocking_detector.offenders.items(), key=lambda item: item[1]["total"], reverse=True)[:3]
+        lines.append("<b>Blocking calls:</b> " + (", ".join(
+            f"<code>{html.escape(site)}</code> {entry['count']}x/{entry['max'] * 1000:.0f} ms max" for site, entry in worst) or "none"))
+    lines.append(f"<i>Updated {datetime.now().strftime('%H:%M:%S')}</i>")
+    return "\n".join(lines)
+
+stats_refreshers: Dict[int, asyncio.Task] = {}
+
+async def refresh_stats(status: Message, text: str):
+    """Re-render the dashboard every STATS_REFRESH_INTERVAL seconds, editing only when it changed."""
+    deadline = time.monotonic() + Config.STATS_REFRESH_DURATION
+    while time.monotonic() < deadline:
+        await asyncio.sleep(Config.STATS_REFRESH_INTERVAL)
+        rendered = await render_stats()
+        if rendered.split("<i>Updated")[0] == text.split("<i>Updated")[0]:
+            continue
+        try:
+            await status.edit_text(rendered)
+            text = rendered
+        except FloodWait as e:
+            await asyncio.sleep(e.value)
+        except Exception as e:
+            logger.debug(f"Stats edit skipped: {e}")
+
+# Command: Owner dashboard
+@bot.on_message(filters.command("stats") & filters.user(Config.OWNER_ID))
+async def stats_command(_, message: Message):
+    """Post the dashboard and keep it refreshed for STATS_REFRESH_DURATION seconds."""
+    text = await render_stats()
+    status = await message.reply_text(text)
+    previous = stats_refreshers.pop(message.chat.id, None)
+    if previous:
+        previous.cancel()  # Only the newest dashboard in a chat keeps refreshing
+    stats_refreshers[message.chat.id] = asyncio.get_running_loop().create_task(refresh_stats(status, text))
+
+def parse_batch_document(name: str, data: bytes) -> List[Dict]:
+    """Rows of a JSONL or CSV job list, each tagged with its line number."""
+    text = data.decode("utf-8-sig")
+    if name.lower().endswith(".csv"):
+        return [{**row, "line": i} for i, row in enumerate(csv.DictReader(io.StringIO(text)), start=2)]
+    rows = []
+    for i, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = {"error": f"invalid JSON ({e})"}
+        rows.append({**row, "line": i} if isinstance(row, dict) else {"error": "not a JSON object", "line": i})
+    return rows
+
+def parse_batch_start(value, now: float) -> float:
+    """'now'/empty, HH:MM[:SS] today, an ISO 8601 datetime or a Unix timestamp (local time when naive)."""
+    value = str(value or "").strip()
+    if value.lower() in ("", "now"):
+        return now
+    if re.fullmatch(r"\d{9,}(\.\d+)?", value):
+        return float(value)
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})(?::(\d{2}))?", value)
+    if match:
+        hour, minute, second = int(match[1]), int(match[2]), int(match[3] or 0)
+        return datetime.fromtimestamp(now).replace(hour=hour, minute=minute, second=second, microsecond=0).timestamp()
+    return datetime.fromisoformat(value).timestamp()
+
+def parse_batch_duration(value) -> int:
+    value = str(value or "").strip()
+    if value.isdigit():
+        return int(value)
+    hours, minutes, seconds = map(int, value.split(":"))
+    return hours * 3600 + minutes * 60 + seconds
+
+def validate_batch_row(row: Dict, now: float) -> Tuple[Dict, List[str]]:
+    """Check one row without probing anything; returns the job spec and its problems."""
+    errors = []
+    if row.get("error"):
+        return {}, [row["error"]]
+    link = str(row.get("link") or row.get("url") or "").strip()
+    channel = str(row.get("channel") or "").strip()
+    if not link and channel:
+        link = channel  # A catalog channel name alone is enough
+    if not link:
+        errors.append("missing link")
+    elif not re.match(r"https?://", link):
+        resolved = channel_index.resolve(link)
+        if not resolved:
+            errors.append(f"unknown channel '{link}'")
+        channel, link = channel or link, resolved
+    title = str(row.get("title") or "").strip()
+    if not title:
+        errors.append("missing title")
+    try:
+        duration = parse_batch_duration(row.get("duration"))
+        if duration <= 0:
+            errors.append("duration must be positive")
+    except ValueError:
+        duration = 0
+        errors.append(f"invalid duration '{row.get('duration')}' (use hh:mm:ss or seconds)")
+    try:
+        start = parse_batch_start(row.get("start"), now)
+    except ValueError:
+        start = now
+        errors.append(f"invalid start '{row.get('start')}'")
+    mode = str(row.get("mode") or "").strip().lower()
+    audio_only = mode == "audio" or str(row.get("audio_only", "")).strip().lower() in ("1", "true", "yes")
+    if mode not in ("", "auto", "audio"):
+        errors.append(f"unknown mode '{mode}'")
+    if link and start < now - 60 and not capture_registry.dvr_for(link):
+        errors.append(f"start {datetime.fromtimestamp(start):%H:%M} has already passed")
+    spec = {
+        "line": row["line"], "link": link, "title": re.sub(r"\s+", ".", title), "channel": re.sub(r"\s+", ".", channel or "IPTV"),
+        "start": start, "duration": duration, "audio_only": audio_only,
+        "video": str(row.get("video") or "auto").strip(), "audio": str(row.get("audio") or "best").strip(),
+    }
+    return spec, errors
+
+def pick_batch_tracks(spec: Dict, auto_choice: Tuple[set, set, float]) -> Tuple[List[Tuple], str]:
+    """Resolve a spec's track preferences against the probed formats into (video, audio) pairs."""
+    formats = stream_formats.get(spec["link"], {})
+    audio_formats = formats.get("audio", [])
+    candidates = audio_only_indices(spec["link"]) if spec["audio_only"] else range(len(audio_formats))
+    if not candidates:
+        return [], "no audio-only renditions found" if spec["audio_only"] else "no audio renditions found"
+    audio = []
+    for preference in spec["audio"].split(","):
+        preference = preference.strip().lower()
+        if preference == "best":
+            audio.append(max(candidates, key=lambda i: audio_formats[i].get("abr") or 0))
+            continue
+        match = next((i for i in candidates if preference in (
+            str(audio_formats[i].get("format_id")).lower(), str(audio_formats[i].get("language") or "").lower()
+        )), None)
+        if match is None:
+            return [], f"no audio track matches '{preference}'"
+        audio.append(match)
+    if spec["audio_only"]:
+        return [(None, idx) for idx in audio], ""
+
+    preference = spec["video"].lower()
+    ranked = rank_video_formats(spec["link"])
+    if not ranked:
+        return [], "no video variants found"
+    if preference == "auto":
+        video = next(iter(auto_choice[1]), None)
+    elif preference == "best":
+        video = ranked[0][0]
+    elif re.fullmatch(r"\d+p?", preference):
+        height = int(preference.rstrip("p"))
+        video = next((idx for idx, fmt in ranked if fmt.get("height") == height), None)
+    else:
+        video = next((idx for idx, fmt in ranked if str(fmt.get("format_id")).lower() == preference), None)
+    if video is None:
+        return [], f"no video variant matches '{spec['video']}'"
+    return [(video, idx) for idx in audio], ""
+
+TERMINAL_JOB_STATES = ("done", "failed", "upload_failed", "superseded", "not started")
+batches: Dict[str, Dict] = {}
+
+def render_batch(batch_id: str) -> str:
+    batch = batches[batch_id]
+    jobs = {tuple(job["batch"]): job for job in job_status.values() if job.get("batch") and job["batch"][0] == batch_id}
+    lines = [f"<b>Batch of {len(batch['entries'])} recording(s):</b>"]
+    for i, entry in enumerate(batch["entries"]):
+        spec = entry["spec"]
+        job = jobs.get((batch_id, i))
+        entry["state"] = job["state"] if job and entry["state"] != "not started" else entry["state"]
+        when = datetime.fromtimestamp(spec["start"]).strftime("%H:%M")
+        lines.append(f"{i + 1}. {html.escape(spec['title'])} ({html.escape(spec['channel'])}) {when} +{format_eta(spec['duration'])}: {entry['state']}")
+    return "\n".join(lines)
+
+async def run_batch_job(batch_id: str, index: int, user_id: int, state: Dict):
+    entry = batches[batch_id]["entries"][index]
+    await asyncio.sleep(max(entry["spec"]["start"] - time.time(), 0))
+    entry["state"] = "starting"
+    await start_recording(user_id, state)
+    if not any(job.get("batch") == [batch_id, index] for job in job_status.values()):
+        entry["state"] = "not started"  # Refused before a job existed (e.g. disk full)
+
+async def monitor_batch(batch_id: str, status: Message, text: str):
+    """Keep the batch's one status message current until every job has finished."""
+    while True:
+        await asyncio.sleep(Config.BATCH_STATUS_INTERVAL)
+        rendered = render_batch(batch_id)
+        if rendered != text:
+            try:
+                await status.edit_text(rendered)
+                text = rendered
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                logger.debug(f"Batch status edit skipped: {e}")
+        if all(entry["state"] in TERMINAL_JOB_STATES for entry in batches[batch_id]["entries"]):
+            return
+
+# Command: Submit many recordings from a JSONL/CSV document
+@bot.on_message(job_list_document & filters.user(Config.AUTH_USERS))
+async def batch_document(_, message: Message):
+    """Validate every job in the document, probe each distinct link once, then schedule them all."""
+    name = message.document.file_name
+    user_id = message.from_user.id
+    bind_log_context(job_id=None, user_id=user_id)
+    if message.document.file_size > Config.BATCH_MAX_BYTES:
+        await message.reply_text(f"Job list too large (max {format_size(Config.BATCH_MAX_BYTES)}).")
+        return
+
+    document = await message.download(in_memory=True)
+    try:
+        rows = parse_batch_document(name, bytes(document.getbuffer()))
+    except (UnicodeDecodeError, csv.Error) as e:
+        await message.reply_text(f"Could not read {name}: {e}")
+        return
+    if not rows or len(rows) > Config.BATCH_MAX_JOBS:
+        await message.reply_text(f"A job list needs between 1 and {Config.BATCH_MAX_JOBS} jobs; {name} has {len(rows)}.")
+        return
+
+    # Step 1: Validate everything before touching the network
+    now = time.time()
+    specs, errors = [], []
+    for row in rows:
+        spec, problems = validate_batch_row(row, now)
+        specs.append(spec)
+        errors += [f"line {row['line']}: {problem}" for problem in problems]
+    if errors:
+        await message.reply_text("Nothing was scheduled. Fix these and resend:\n" + "\n".join(errors[:30])
+                                 + (f"\n…and {len(errors) - 30} more" if len(errors) > 30 else ""))
+        return
+
+    # Step 2: Probe each distinct link once (DVR rewinds use the buffer's variant and need no probe)
+    links = list(dict.fromkeys(spec["link"] for spec in specs if not (spec["start"] < now and capture_registry.dvr_for(spec["link"]))))
+    status = await message.reply_text(f"Validated {len(specs)} job(s); probing {len(links)} distinct link(s)...")
+    auto_choices = {}
+    for link in links:
+        await refresh_stream_formats(link)
+        if any(spec["link"] == link and spec["video"].lower() == "auto" and not spec["audio_only"] for spec in specs):
+            auto_choices[link] = await auto_select_streams(link)
+    metrics["batch_probes_saved"] += len(specs) - len(links)
+
+    states = []
+    for spec in specs:
+        buffer = capture_registry.dvr_for(spec["link"])
+        state = {"link": spec["link"], "duration": spec["duration"], "title": spec["title"], "channel": spec["channel"],
+                 "audio_only": spec["audio_only"]}
+        if spec["start"] < now and buffer is not None:
+            state.update(pairs=[(buffer.video, buffer.audio)], window_start=max(spec["start"], buffer.oldest),
+                         audio_only=buffer.video is None)
+        else:
+            pairs, problem = pick_batch_tracks(spec, auto_choices.get(spec["link"], (set(), set(), 0.0)))
+            if problem:
+                errors.append(f"line {spec['line']}: {problem}")
+            state["pairs"] = pairs
+        states.append(state)
+    if errors:
+        await status.edit_text("Nothing was scheduled. Fix these and resend:\n" + "\n".join(errors[:30]))
+        return
+
+    # Step 3: Schedule the whole batch and report it in one message
+    batch_id = f"batch-{user_id}-{int(now * 1000)}"
+    batches[batch_id] = {"user_id": user_id, "entries": [{"spec": spec, "state": "scheduled"} for spec in specs]}
+    loop = asyncio.get_running_loop()
+    for i, state in enumerate(states):
+        state["batch"] = [batch_id, i]
+        loop.create_task(run_batch_job(batch_id, i, user_id, state))
+    logger.info(f"Scheduled {batch_id} with {len(specs)} job(s) over {len(links)} link(s)")
+    text = render_batch(batch_id)
+    await status.edit_text(text)
+    loop.create_task(monitor_batch(batch_id, status, text))
+
 # Command: Record
 @bot.on_message(
     (filters.private | filters.group) &  # Allow both private messages and groups
-    filters.regex(r"https?://.*\s\d{2}:\d{2}:\d{2}") &  # Match URL followed by timestamp
+    filters.regex(r"(https?://\S+|^/record\s+\S+)\s+(-[\d:]+\s+)?\d{2}:\d{2}:\d{2}") &  # URL or channel name, optional DVR offset, timestamp
     filters.user(Config.AUTH_USERS)  # Restrict to authorized users
 )
 async def record_command(_, message: Message):
-    args = message.text.split(maxsplit=5)  # Split into 5 parts (link, duration, title, channel)
-    
-    if len(args) != 5:
-        await message.reply_text("Invalid format! Use: /record <link> <hh:mm:ss> \"<title>\" \"<channel>\"")
+    bind_log_context(job_id=None, user_id=message.from_user.id)
+    args = message.text.split(maxsplit=5)  # Split into 5 parts (link, duration, title, channel) plus optional mode
+    rewind = None
+    if len(args) > 2 and args[2].startswith("-"):
+        # DVR: /record <channel> -mm:ss <hh:mm:ss> ... starts that far in the past
+        args = message.text.split(maxsplit=6)
+        rewind = args.pop(2)
+
+    if len(args) not in (5, 6):
+        await message.reply_text("Invalid format! Use: /record <link> [-mm:ss] <hh:mm:ss> \"<title>\" \"<channel>\" [auto|audio]")
         return
 
     link, duration, title, channel = args[1], args[2], args[3], args[4]
+    mode = args[5].strip().lower() if len(args) == 6 else ""
+
+    if not re.match(r"https?://", link):
+        resolved = channel_index.resolve(link)
+        if not resolved:
+            suggestions = ", ".join(channel_index.search(link, limit=5)) or "none"
+            await message.reply_text(f"Unknown channel '{link}'. Did you mean: {suggestions}")
+            return
+        link = resolved
     
     try:
         hours, minutes, seconds = map(int, duration.split(":"))
@@ -204,6 +1754,29 @@ async def record_command(_, message: Message):
         await message.reply_text("Invalid duration format. Use hh:mm:ss.")
         return
 
+    if rewind:
+        try:
+            rewind_seconds = sum(int(part) * 60 ** i for i, part in enumerate(reversed(rewind[1:].split(":"))))
+        except ValueError:
+            await message.reply_text("Invalid DVR offset. Use -mm:ss or -hh:mm:ss.")
+            return
+        buffer = capture_registry.dvr_for(link)
+        if buffer is None:
+            await message.reply_text("This channel has no DVR buffer; only live recordings are possible.")
+            return
+        # The buffer's variant is already chosen and ingesting: no probe, no selection
+        window_start = max(time.time() - rewind_seconds, buffer.oldest)
+        user_states[message.from_user.id] = {
+            "link": link, "duration": duration_seconds, "title": title, "channel": channel,
+            "pairs": [(buffer.video, buffer.audio)], "audio_only": buffer.video is None,
+            "window_start": window_start,
+        }
+        behind = time.time() - window_start
+        note = "" if behind >= rewind_seconds - Config.SHARED_SEGMENT_SECONDS else f" (only {behind / 60:.1f} min buffered)"
+        await message.reply_text(f"Recording from the DVR buffer, starting {behind / 60:.1f} min ago{note}...")
+        await start_recording(message.from_user.id)
+        return
+
     await message.reply_text("Fetching streams, please wait...")
 
     audio_streams, video_streams, audio_video_streams = await parse_streams(link)
@@ -220,16 +1793,39 @@ async def record_command(_, message: Message):
         "video_streams": video_streams,
         "audio_video_streams": audio_video_streams,  # Add this to track multiplexed streams
         "title": title,
-        "channel": channel
+        "channel": channel,
+        "audio_only": mode == "audio",  # Radio/commentary: skip video selection and ingest audio renditions only
     }
 
+    if mode == "auto":
+        state = user_states[message.from_user.id]
+        state["audio_selected"], state["video_selected"], factor = await auto_select_streams(link)
+        if not state["video_selected"]:
+            await message.reply_text("Auto-select could not find a usable audio and video pair. Please pick tracks manually.")
+        else:
+            video_label = state["video_streams"][next(iter(state["video_selected"]))]
+            await message.reply_text(f"Auto-selected {video_label} ({factor:.2f}x realtime). Starting recording...")
+            await start_recording(message.from_user.id)
+            return
+
+    if mode == "audio":
+        # Offer only renditions without video; button positions map back to the full audio list
+        state = user_states[message.from_user.id]
+        state["audio_indices"] = audio_only_indices(link)
+        state["audio_streams"] = [audio_streams[i] for i in state["audio_indices"]]
+        if not state["audio_streams"]:
+            await message.reply_text("No audio-only renditions found for audio mode. Record without 'audio' instead.")
+            return
+        audio_streams = state["audio_streams"]
+
     buttons = create_buttons(audio_streams, set(), "audio")
     await message.reply_text("Select audio tracks (multi-select):", reply_markup=buttons)
 
 # Callback: Handle stream selection
-@bot.on_callback_query(filters.regex(r"^(audio|video|multiplexed)_(\d+|confirm)$"))
+@bot.on_callback_query(filters.regex(r"^(audio|video|multiplexed)_(\d+|p\d+|confirm)$"))
 async def handle_selection(_, query: CallbackQuery):
     user_id = query.from_user.id
+    bind_log_context(job_id=None, user_id=user_id)
     state = user_states.get(user_id)
     if not state:
         await query.answer("Session expired. Start again.", show_alert=True)
@@ -240,6 +1836,10 @@ async def handle_selection(_, query: CallbackQuery):
         if prefix == "audio" and not state["audio_selected"]:
             await query.answer("Please select at least one audio track.", show_alert=True)
             return
+        elif prefix == "audio" and state.get("audio_only"):
+            await query.message.edit_text("Starting audio-only recording...")
+            await start_recording(user_id)
+            return
         elif prefix == "audio":
             buttons = create_buttons(state["video_streams"], set(), "video")
             await query.message.edit_text("Select a video track (single select):", reply_markup=buttons)
@@ -260,27 +1860,36 @@ async def handle_selection(_, query: CallbackQuery):
             await start_recording(user_id)
             return
 
-    idx = int(action)
     selected = state["audio_selected"] if prefix == "audio" else \
               state["video_selected"] if prefix == "video" else \
-              state.get("audio_video_selected", set())
+              state.setdefault("audio_video_selected", set())
 
-    if prefix == "video":
-        # Clear previous selection and select the new one
-        state["video_selected"].clear()
-        state["video_selected"].add(idx)
+    if action.startswith("p"):
+        # Page navigation only
+        page = int(action[1:])
+        if page == state.get("page", {}).get(prefix, 0):
+            await query.answer()
+            return
     else:
-        if idx in selected:
-            selected.remove(idx)
+        idx = int(action)
+        page = idx // BUTTONS_PER_PAGE
+        if prefix == "video":
+            # Clear previous selection and select the new one
+            state["video_selected"].clear()
+            state["video_selected"].add(idx)
         else:
-            selected.add(idx)
+            if idx in selected:
+                selected.remove(idx)
+            else:
+                selected.add(idx)
+    state.setdefault("page", {})[prefix] = page
 
     buttons = create_buttons(
-        state["audio_streams"], state["audio_selected"], "audio"
+        state["audio_streams"], state["audio_selected"], "audio", page
     ) if prefix == "audio" else create_buttons(
-        state["video_streams"], state["video_selected"], "video"
+        state["video_streams"], state["video_selected"], "video", page
     ) if prefix == "video" else create_buttons(
-        state["audio_video_streams"], state.get("audio_video_selected", set()), "multiplexed"
+        state["audio_video_streams"], state["audio_video_selected"], "multiplexed", page
     )
 
     await query.message.edit_text(
@@ -315,34 +1924,618 @@ def classify_stream(link):
         return "Smooth Streaming"
     elif "webm" in link:
         return "WebM"
+    elif "flv" in link:
+        return "FLV"
     # Add more types as needed
     else:
         return "Unknown"
 
-# Adaptive method to handle stream types with start time adjustment
-async def run_command_with_adaptive_logic(cmd, stream_type, stream_level, start_time=None):
-    """Run a command with adaptive handling for different stream types."""
-    if stream_type == "HLS" or stream_type == "DASH":
-        # Adjusting for HLS/DASH streams by setting the start time for synchronization
-        if start_time:
-            cmd += f" -ss {start_time}"
-
-    elif stream_type == "RTMP":
-        cmd += " -rtmp_buffer 2000"
-    elif stream_type == "MMS":
-        cmd += " -mms_buffer_size 2000"
-    elif stream_type == "Smooth Streaming":
-        cmd += " -smoothstreaming"
-    elif stream_type == "WebM":
-        cmd += " -c:v vp9 -b:v 1M"
-    elif stream_type == "CMAF":
-        cmd += " -cmaf"
-    elif stream_type == "SRT":
-        cmd += " -srt_live_latency 5000"
-    elif stream_type == "FLV":
-        cmd += " -c:v flv -c:a aac"
-
-    return await run_command(cmd)
+# Named transcode presets; "fallback" is the cheaper preset used when one can't keep up
+TRANSCODE_PRESETS = {
+    "vp9": {"args": "-c:v libvpx-vp9 -deadline realtime -cpu-used 8 -row-mt 1 -b:v 1M", "fallback": "vp9-480p"},
+    "vp9-480p": {"args": "-c:v libvpx-vp9 -deadline realtime -cpu-used 8 -row-mt 1 -vf scale=-2:480 -b:v 600k", "fallback": None},
+    "flv": {"args": "-c:v libx264 -preset veryfast -c:a aac", "fallback": "flv-360p"},
+    "flv-360p": {"args": "-c:v libx264 -preset ultrafast -vf scale=-2:360 -c:a aac", "fallback": None},
+}
+STREAM_TYPE_PRESETS = {"WebM": "vp9", "FLV": "flv"}
+
+class TranscodeScheduler:
+    """Runs encodes in a CPU-sized, niced pool and keeps stream-copy jobs on their own lane.
+
+    Every finished encode updates the preset's measured realtime factor (the
+    "speed=" ffmpeg reports). New jobs run on the first preset in the
+    fallback chain that has not been measured below realtime.
+    """
+
+    def __init__(self, threads_per_job: int, niceness: int, min_realtime: float, copy_jobs: int):
+        # Only the CPUs this process may run on; a container or cgroup often allows fewer than cpu_count()
+        if hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+        self.threads_per_job = max(1, min(threads_per_job, len(cpus)))
+        self.pool_size = max(1, len(cpus) // self.threads_per_job)
+        self.niceness = niceness
+        self.min_realtime = min_realtime
+        self.slots = asyncio.Semaphore(self.pool_size)
+        self.copy_lane = asyncio.Semaphore(copy_jobs)
+        self.free_cpu_sets = [
+            cpus[i * self.threads_per_job:(i + 1) * self.threads_per_job] for i in range(self.pool_size)
+        ]
+        self.realtime_factor: Dict[str, float] = {}
+        self.has_nice = shutil.which("nice") is not None
+        self.has_taskset = shutil.which("taskset") is not None
+
+    def admit(self, preset: str):
+        """Return the preset to run, downgrading along the fallback chain; None (stream copy) if none keeps up.
+
+        Called before a capture starts, so a rejection never costs a finished recording.
+        """
+        candidate = preset
+        while candidate:
+            if self.realtime_factor.get(candidate, self.min_realtime) >= self.min_realtime:
+                if candidate != preset:
+                    logger.info(f"Transcode preset {preset} can't sustain realtime; downgrading to {candidate}")
+                return candidate
+            candidate = TRANSCODE_PRESETS[candidate]["fallback"]
+        logger.warning(f"Transcode preset {preset} and its fallbacks run below {self.min_realtime}x realtime; "
+                       f"stream-copying instead")
+        metrics["transcodes_rejected"] += 1
+        return None
+
+    def record_speed(self, preset: str, stderr: str, smoothing: float = 0.5):
+        speeds = re.findall(r"speed=\s*([\d.]+)x", stderr)
+        if not speeds:
+            return
+        speed = float(speeds[-1])
+        previous = self.realtime_factor.get(preset)
+        self.realtime_factor[preset] = speed if previous is None else smoothing * speed + (1 - smoothing) * previous
+        logger.info(f"Transcode preset {preset} ran at {speed:.2f}x realtime")
+
+    async def run_copy(self, cmd: List[str], **run_options) -> Tuple[str, str]:
+        async with self.copy_lane:
+            return await run_command(cmd, **run_options)
+
+    async def run_transcode(self, cmd: List[str], preset: str, **run_options) -> Tuple[str, str]:
+        """Run `cmd` with an admitted preset's codec options inserted before its output file (the last argument)."""
+        async with self.slots:
+            cpu_set = self.free_cpu_sets.pop()
+            try:
+                prefix = []
+                if self.has_nice:
+                    prefix += ["nice", "-n", str(self.niceness)]
+                if self.has_taskset:
+                    prefix += ["taskset", "-c", ",".join(map(str, cpu_set))]
+                codec_args = shlex.split(TRANSCODE_PRESETS[preset]["args"]) + ["-threads", str(self.threads_per_job)]
+                full_cmd = prefix + cmd[:-1] + codec_args + cmd[-1:]
+                stdout, stderr = await run_command(full_cmd, **run_options)
+                self.record_speed(preset, stderr)
+                return stdout, stderr
+            finally:
+                self.free_cpu_sets.append(cpu_set)
+
+transcode_scheduler = TranscodeScheduler(
+    Config.TRANSCODE_THREADS, Config.TRANSCODE_NICE, Config.TRANSCODE_MIN_REALTIME, Config.MAX_COPY_JOBS
+)
+
+def track_bitrate(link: str, kind: str, idx: int) -> float:
+    """Nominal kbps of a selected audio/video track, 0 when unknown (or None: a muxed variant's own audio)."""
+    formats = stream_formats.get(link, {}).get(kind, [])
+    if idx is None or idx >= len(formats):
+        return 0
+    fmt = formats[idx]
+    return (fmt.get("abr") if kind == "audio" else fmt.get("tbr")) or 0
+
+def downgrade_for_origin(link: str, video_idx: int, audio_kbps: float) -> int:
+    """Step down to a lighter video variant when the origin has no headroom for the chosen one."""
+    headroom = origin_governor.headroom(track_url(link, "video", video_idx))
+    if headroom is None or track_bitrate(link, "video", video_idx) + audio_kbps <= headroom:
+        return video_idx
+    ranked = rank_video_formats(link)
+    position = next((pos for pos, (idx, _) in enumerate(ranked) if idx == video_idx), 0)
+    for idx, fmt in ranked[position + 1:]:
+        if (fmt.get("tbr") or 0) + audio_kbps <= headroom:
+            logger.info(f"Origin {origin_governor.host(track_url(link, 'video', video_idx))} saturated; downgrading video track {video_idx} -> {idx}")
+            return idx
+    return video_idx
+
+class SharedIngest:
+    """One live capture of a (link, video, audio) variant that any number of jobs slice.
+
+    ffmpeg writes the variant as MPEG-TS segments plus a CSV segment list.
+    Segment timestamps are mapped to wall-clock time from the moment the
+    ingest started, so each subscriber copies out only the segments covering
+    its own window. The ingest stops SHARED_INGEST_LINGER seconds after its
+    last subscriber leaves.
+
+    Every finished segment is run through a TSValidator, so each window
+    comes back with an integrity report. An ingest whose segments carry no
+    audio or video for DEAD_STREAM_SECONDS is aborted as dead.
+    """
+
+    persistent = False  # Keep running (and reopen the source) without subscribers
+    _ids = itertools.count(1)  # Ingests started in the same second still get distinct ids and directories
+
+    def __init__(self, key: Tuple, link: str, video: int, audio: int, bitrate_kbps: float,
+                 start_index: Dict[str, int] = None, user_id: int = None):
+        self.key = key
+        self.link = link
+        self.video = video
+        self.audio = audio
+        self.bitrate_kbps = bitrate_kbps
+        self.start_index = start_index
+        self.user_id = user_id
+        self.ingest_id = f"ingest-{int(time.time())}-{next(SharedIngest._ids)}"
+        self.directory = os.path.join(DOWNLOADS_DIR, self.ingest_id)
+        self.anchor_wall = time.time()
+        self.segments: List[Dict] = []
+        self.bytes_written = 0
+        self.subscribers: List[Dict] = []
+        self.idle_since = None
+        self.finished = asyncio.Event()
+        self.validator = TSValidator(Config.GAP_THRESHOLD)
+        self.last_healthy = time.time()
+        self.dead_reason = None
+        self._validate_lock = asyncio.Lock()
+        self._lists: Dict[str, float] = {}  # Segment list of each ffmpeg run -> wall time it started
+        self._list_offsets: Dict[str, int] = {}
+        self._wall_offsets: Dict[str, float] = {}  # Segment list -> wall time minus PTS of its segments
+        self._task = None
+
+    @property
+    def origin_url(self) -> str:
+        """The URL ffmpeg fetches first; its host, not the master link's, is the origin being loaded."""
+        return ingest_plan(self.link, self.video, self.audio)[0][0]
+
+    def capture_cmd(self, part: int) -> Tuple[str, List[str]]:
+        list_path = os.path.join(self.directory, f"segments_{part}.csv")
+        sources, maps = ingest_plan(self.link, self.video, self.audio)
+        inputs = []
+        for url in sources:
+            if part == 0 and self.start_index and url in self.start_index:
+                inputs += ["-live_start_index", str(self.start_index[url])]
+            inputs += ["-i", url]
+        return list_path, [
+            "ffmpeg", "-y", "-nostats", "-loglevel", "warning", *inputs, *[arg for spec in maps for arg in ("-map", spec)], "-c", "copy", "-copyts",
+            "-f", "segment", "-segment_time", str(Config.SHARED_SEGMENT_SECONDS), "-segment_format", "mpegts",
+            "-segment_list", list_path, "-segment_list_type", "csv",
+            os.path.join(self.directory, f"p{part}_%06d.ts"),
+        ]
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        job_status[self.ingest_id] = {"user_id": self.user_id, "link": self.link, "state": "ingesting",
+                                      "started": time.time(), "subscribers": 0}
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._run())
+        loop.create_task(self._watch())
+
+    async def _run(self):
+        bind_log_context(job_id=None, user_id=None, ingest=self.ingest_id)
+        started = time.monotonic()
+        try:
+            if origin_governor.saturated(self.origin_url):
+                job_status[self.ingest_id]["state"] = "queued"
+                if self.user_id:
+                    await send_notification(self.user_id, f"Origin {origin_governor.host(self.origin_url)} is busy, your recording is queued...")
+            async with origin_governor.slot(self.origin_url, self.bitrate_kbps):
+                job_status[self.ingest_id]["state"] = "dvr" if self.persistent else "ingesting"
+                started = time.monotonic()
+                part = 0
+                while True:
+                    list_path, cmd = self.capture_cmd(part)
+                    self._lists[list_path] = time.time()
+                    try:
+                        await run_command(cmd, self.ingest_id, progress_file=list_path,
+                                          stall_timeout=Config.STALL_TIMEOUT)
+                        if not self.persistent:
+                            break  # Source ended
+                        logger.warning(f"{self.ingest_id} source ended; reopening")
+                        await asyncio.sleep(Config.SHARED_SEGMENT_SECONDS)
+                    except CommandStalled:
+                        if part >= Config.MAX_STALL_RESTARTS and not self.persistent:
+                            logger.error(f"{self.ingest_id} stalled {part + 1} times; giving up")
+                            break
+                        logger.warning(f"{self.ingest_id} stalled; restarting at the live edge")
+                        metrics["stall_restarts"] += 1
+                    part += 1
+        except asyncio.TimeoutError:
+            host = origin_governor.host(self.origin_url)
+            self.dead_reason = f"origin {host} stayed saturated for {origin_governor.queue_timeout:.0f}s"
+            logger.error(f"{self.ingest_id} gave up waiting: {self.dead_reason}")
+            metrics["origin_queue_timeouts"] += 1
+            if self.user_id:
+                await send_notification(self.user_id, f"Recording aborted: {self.dead_reason}.")
+        except asyncio.CancelledError:
+            pass  # Stopped by _watch
+        finally:
+            self.poll()
+            elapsed = time.monotonic() - started
+            if self.segments and elapsed > 0:
+                origin_governor.observe(self.origin_url, sum(seg["size"] for seg in self.segments) * 8 / 1000 / elapsed)
+            job_status[self.ingest_id]["state"] = "done"
+            if capture_registry.ingests.get(self.key) is self:
+                del capture_registry.ingests[self.key]
+            self.finished.set()
+
+    async def _watch(self):
+        bind_log_context(job_id=None, user_id=None, ingest=self.ingest_id)
+        while not self.finished.is_set():
+            await asyncio.sleep(1)
+            self.poll()
+            await self.validate()
+            self.prune()
+            if (not self.persistent and not self.subscribers and self.idle_since
+                    and time.time() - self.idle_since > Config.SHARED_INGEST_LINGER):
+                logger.info(f"{self.ingest_id} has no subscribers left; stopping")
+                self._task.cancel()
+                await self.finished.wait()
+        while self.subscribers:  # Let late readers finish copying before the segments go
+            await asyncio.sleep(1)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def poll(self):
+        """Pick up segments ffmpeg has finished since the last call."""
+        for list_path, list_started in self._lists.items():
+            try:
+                with open(list_path, "r") as f:
+                    f.seek(self._list_offsets.get(list_path, 0))
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            complete = data[:data.rfind("\n") + 1]
+            self._list_offsets[list_path] = self._list_offsets.get(list_path, 0) + len(complete)
+            for line in complete.splitlines():
+                name, pts_start, pts_end = line.rsplit(",", 2)
+                path = os.path.join(self.directory, name)
+                pts_start, pts_end = float(pts_start), float(pts_end)
+                # Each ffmpeg run restarts at the live edge, often with reset PTS, so anchor its list separately
+                wall_offset = self._wall_offsets.setdefault(list_path, list_started - pts_start)
+                self.segments.append({
+                    "path": path,
+                    "list": list_path,
+                    "pts_start": pts_start,
+                    "pts_end": pts_end,
+                    "wall_offset": wall_offset,
+                    "wall_start": pts_start + wall_offset,
+                    "wall_end": pts_end + wall_offset,
+                    "size": os.path.getsize(path) if os.path.exists(path) else 0,
+                    "arrived": time.time(),
+                })
+                self.bytes_written += self.segments[-1]["size"]
+
+    async def validate(self):
+        """Check segments not validated yet, and abort the ingest if the stream has gone dead."""
+        async with self._validate_lock:
+            for segment in [seg for seg in self.segments if "report" not in seg]:
+                try:
+                    segment["report"] = await asyncio.to_thread(self.validator.feed_file, segment["path"])
+                except OSError:
+                    segment["report"] = {"video": 0.0, "audio": 0.0, "gaps": [], "cc_errors": 0, "audio_tracks": 0}
+                length = segment["pts_end"] - segment["pts_start"]
+                if max(segment["report"]["video"], segment["report"]["audio"]) >= 0.1 * length:
+                    self.last_healthy = time.time()
+
+        silent_for = time.time() - self.last_healthy
+        if self.dead_reason is None and self.segments and silent_for > Config.DEAD_STREAM_SECONDS:
+            self.dead_reason = f"no audio or video data for {silent_for:.0f}s"
+            logger.error(f"{self.ingest_id} is dead ({self.dead_reason}); aborting")
+            metrics["dead_streams"] += 1
+            self._task.cancel()
+
+    def window_report(self, start: float, end: float, segments: List[Dict]) -> Dict:
+        """Integrity of [start, end]: seconds covered, gaps (offsets into the window), audio presence."""
+        report = {"covered": 0.0, "audio": 0.0, "gaps": [], "cc_errors": 0, "audio_tracks": 0, "dead": self.dead_reason}
+        primary = "video" if "video" in self.validator.stream_kinds.values() else "audio"
+        for segment in segments:
+            checked = segment.get("report")
+            if not checked:
+                continue
+            span = segment["wall_end"] - segment["wall_start"]
+            overlap = min(end, segment["wall_end"]) - max(start, segment["wall_start"])
+            share = overlap / span if span > 0 else 0.0
+            report["covered"] += share * checked[primary]
+            report["audio"] += share * checked["audio"]
+            report["cc_errors"] += checked["cc_errors"]
+            report["audio_tracks"] = max(report["audio_tracks"], checked["audio_tracks"])
+            for gap in checked["gaps"]:
+                offset = gap["at"] + segment["wall_offset"] - start
+                if 0 <= offset <= end - start:
+                    report["gaps"].append({"kind": gap["kind"], "at": offset, "length": gap["length"]})
+        report["audio_missing"] = report["audio_tracks"] == 0 or report["audio"] < 0.1 * report["covered"]
+        return report
+
+    def prune(self):
+        """Delete segments that ended before every remaining subscriber's window."""
+        if not self.subscribers:
+            return
+        keep_from = min(window["start"] for window in self.subscribers) - Config.SHARED_SEGMENT_SECONDS
+        while self.segments and self.segments[0]["wall_end"] < keep_from and "report" in self.segments[0]:
+            segment = self.segments.pop(0)
+            if os.path.exists(segment["path"]):
+                os.remove(segment["path"])
+        self.prune_lists()
+
+    def prune_lists(self):
+        """Forget the segment lists of earlier ffmpeg runs once all their segments are pruned."""
+        self.poll()  # A finished run's last lines must be indexed before its list can go
+        current = next(reversed(self._lists), None)
+        live = {segment["list"] for segment in self.segments}
+        for list_path in [path for path in self._lists if path != current and path not in live]:
+            del self._lists[list_path]
+            self._list_offsets.pop(list_path, None)
+            self._wall_offsets.pop(list_path, None)
+            if os.path.exists(list_path):
+                os.remove(list_path)
+
+    def realtime_factor(self, window: float = 60) -> float:
+        """Media seconds ingested per wall-clock second over the last `window` seconds."""
+        now = time.time()
+        span = min(window, now - self.anchor_wall)
+        recent = [seg for seg in self.segments if seg["arrived"] >= now - window]
+        return sum(seg["pts_end"] - seg["pts_start"] for seg in recent) / span if span > 0 else 0.0
+
+    def covers(self, end: float) -> bool:
+        return bool(self.segments) and self.segments[-1]["wall_end"] >= end
+
+    async def capture_window(self, start: float, end: float, output_file: str, job_id: str = None) -> Dict:
+        """Wait for the ingest to cover [start, end] (wall clock), copy those segments to output_file
+        and return the window's integrity report.
+
+        What the ingest's ffmpeg used meanwhile is charged to `job_id`; every
+        subscriber is charged in full, as each would have needed its own capture.
+        """
+        window = {"start": start, "end": end}
+        self.subscribers.append(window)
+        self.idle_since = None
+        job_status[self.ingest_id]["subscribers"] = len(self.subscribers)
+        usage = job_status[self.ingest_id].get("usage", {})
+        cpu_before, written_before = usage.get("cpu", 0.0), usage.get("write_bytes", 0)
+        peak_rss = usage.get("rss", 0)
+        try:
+            while not self.finished.is_set() and not self.covers(end) and time.time() < end + Config.DEADLINE_GRACE:
+                try:
+                    await asyncio.wait_for(self.finished.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    self.poll()
+                peak_rss = max(peak_rss, job_status[self.ingest_id].get("usage", {}).get("rss", 0))
+            self.poll()
+            await self.validate()
+            segments = [seg for seg in self.segments if seg["wall_end"] > start and seg["wall_start"] < end]
+            await asyncio.to_thread(self._join, [seg["path"] for seg in segments], output_file)
+            return self.window_report(start, end, segments)
+        finally:
+            self.subscribers.remove(window)
+            job_status[self.ingest_id]["subscribers"] = len(self.subscribers)
+            usage = job_status[self.ingest_id].get("usage", {})
+            process_tracker.charge(job_id, usage.get("cpu", 0.0) - cpu_before,
+                                   usage.get("write_bytes", 0) - written_before, peak_rss)
+            if not self.subscribers:
+                self.idle_since = time.time()
+
+    @staticmethod
+    def _join(paths: List[str], output_file: str):
+        with open(output_file, "wb") as out:
+            for path in paths:
+                if os.path.exists(path):
+                    with open(path, "rb") as segment:
+                        shutil.copyfileobj(segment, out, 1024 * 1024)
+
+class DVRBuffer(SharedIngest):
+    """A shared ingest that runs continuously and keeps the last DVR_MINUTES (at most DVR_MAX_MB) on disk.
+
+    Its segment list is the in-memory index of the ring buffer, so a window
+    reaching into the past is cut from segments already on disk while the
+    rest is still being captured. Segments a subscriber still needs are kept
+    even past the bounds.
+    """
+
+    persistent = True
+
+    def __init__(self, key: Tuple, link: str, video: int, audio: int, bitrate_kbps: float,
+                 retain_seconds: float, retain_bytes: int):
+        super().__init__(key, link, video, audio, bitrate_kbps)
+        self.ingest_id = f"ingest-dvr-{int(time.time())}-{next(SharedIngest._ids)}"
+        self.directory = os.path.join(DOWNLOADS_DIR, self.ingest_id)
+        self.retain_seconds = retain_seconds
+        self.retain_bytes = retain_bytes
+
+    @property
+    def oldest(self) -> float:
+        """Wall-clock start of the oldest buffered segment (now when the buffer is empty)."""
+        return self.segments[0]["wall_start"] if self.segments else time.time()
+
+    def prune(self):
+        """Drop segments older than the retention window, then the oldest ones while over the byte budget."""
+        keep_from = time.time() - self.retain_seconds
+        if self.subscribers:
+            keep_from = min(keep_from, min(window["start"] for window in self.subscribers) - Config.SHARED_SEGMENT_SECONDS)
+        total = sum(seg["size"] for seg in self.segments)
+        while len(self.segments) > 1 and "report" in self.segments[0]:
+            segment = self.segments[0]
+            needed = segment["wall_end"] >= keep_from
+            if needed and (total <= self.retain_bytes or any(window["start"] < segment["wall_end"] for window in self.subscribers)):
+                break
+            self.segments.pop(0)
+            total -= segment["size"]
+            if os.path.exists(segment["path"]):
+                os.remove(segment["path"])
+        self.prune_lists()
+
+class CaptureRegistry:
+    """Active shared ingests keyed by (link, video, audio); video is None for audio-only ingests."""
+
+    def __init__(self):
+        self.ingests: Dict[Tuple, SharedIngest] = {}
+        self.dvr: Dict[str, DVRBuffer] = {}
+
+    def start_dvr(self, link: str, video: int, audio: int) -> DVRBuffer:
+        """Start the DVR buffer of a channel; new recordings of the same variant join it."""
+        key = (link, video, audio)
+        bitrate_kbps = track_bitrate(link, "video", video) + track_bitrate(link, "audio", audio)
+        buffer = DVRBuffer(key, link, video, audio, bitrate_kbps, Config.DVR_MINUTES * 60, Config.DVR_MAX_MB * 1024 * 1024)
+        self.ingests[key] = self.dvr[link] = buffer
+        buffer.start()
+        job_status[buffer.ingest_id]["state"] = "dvr"
+        metrics["dvr_starts"] += 1
+        logger.info(f"Started DVR buffer {buffer.ingest_id} for {link} (video {video}, audio {audio})")
+        return buffer
+
+    def dvr_for(self, link: str):
+        buffer = self.dvr.get(link)
+        return buffer if buffer is not None and not buffer.finished.is_set() else None
+
+    def active(self, link: str, video: int, audio: int):
+        ingest = self.ingests.get((link, video, audio))
+        return ingest if ingest is not None and not ingest.finished.is_set() else None
+
+    def variant_for(self, link: str, video: int, audio: int) -> Tuple[int, int]:
+        """The (video, audio) a capture of this selection will actually ingest."""
+        if self.active(link, video, audio) is None and video is not None:
+            # Only a new ingest is subject to downgrading; joining an existing one costs the origin nothing
+            video = downgrade_for_origin(link, video, track_bitrate(link, "audio", audio))
+        return video, audio
+
+    def get_or_start(self, user_id: int, link: str, video: int, audio: int,
+                     start_index: Dict[str, int] = None) -> SharedIngest:
+        """Join or start the ingest of `variant_for(...)`; its .video/.audio are what gets recorded."""
+        video, audio = self.variant_for(link, video, audio)
+        ingest = self.active(link, video, audio)
+        if ingest is not None:
+            metrics["shared_ingest_joins"] += 1
+            logger.info(f"Joining active {ingest.ingest_id} for {link} (video {video}, audio {audio})")
+            return ingest
+
+        key = (link, video, audio)
+        video_kbps = track_bitrate(link, "video", video) if video is not None else 0
+        bitrate_kbps = video_kbps + track_bitrate(link, "audio", audio)
+        ingest = SharedIngest(key, link, video, audio, bitrate_kbps, start_index, user_id)
+        self.ingests[key] = ingest
+        ingest.start()
+        metrics["shared_ingest_starts"] += 1
+        return ingest
+
+capture_registry = CaptureRegistry()
+
+def audio_codec_family(fmt: dict) -> str:
+    """Codec of a format's audio without its profile, e.g. "mp4a" for mp4a.40.2."""
+    return (fmt.get("acodec") or "none").split(".")[0]
+
+def track_format(link: str, kind: str, idx: int) -> dict:
+    """yt_dlp format of a selected track, empty when unknown."""
+    formats = stream_formats.get(link, {}).get(kind, [])
+    return formats[idx] if idx is not None and idx < len(formats) else {}
+
+def track_url(link: str, kind: str, idx: int) -> str:
+    """Media playlist URL of a selected track, falling back to the link itself."""
+    return track_format(link, kind, idx).get("url") or link
+
+def ingest_plan(link: str, video: int, audio: int) -> Tuple[List[str], List[str]]:
+    """ffmpeg inputs and -map specs for a variant, reading each track's own media playlist.
+
+    Opening the master would make ffmpeg fetch every variant playlist only to
+    discard them; a track whose URL is unknown still falls back to the master.
+    An audio selection that is itself a muxed A/V variant is not opened just
+    for its audio: the audio comes from the video input when that carries the
+    same codec, otherwise from a matching audio-only rendition.
+    """
+    audio_fmt = track_format(link, "audio", audio)
+    if is_muxed(audio_fmt):
+        video_fmt = track_format(link, "video", video)
+        if is_muxed(video_fmt) and audio_codec_family(video_fmt) == audio_codec_family(audio_fmt):
+            audio = None  # Mapped from the video input below
+        else:
+            formats = stream_formats.get(link, {}).get("audio", [])
+            matches = sorted(
+                audio_only_indices(link),
+                key=lambda i: (audio_codec_family(formats[i]) != audio_codec_family(audio_fmt),
+                               formats[i].get("language") != audio_fmt.get("language"),
+                               -(formats[i].get("abr") or formats[i].get("tbr") or 0)),
+            )
+            audio = matches[0] if matches else audio
+    sources, maps = [], []
+    for kind, idx in (("video", video), ("audio", audio)):
+        if idx is None:
+            continue
+        url = track_url(link, kind, idx)
+        if url not in sources:
+            sources.append(url)
+        maps.append(f"{sources.index(url)}:{kind[0]}:{0 if url != link else idx}")
+    if audio is None and is_muxed(track_format(link, "video", video)):
+        maps.append(f"{sources.index(track_url(link, 'video', video))}:a:0")  # The variant's own audio
+    return sources, maps
+
+async def plan_synchronized_start(urls: List[str]) -> Tuple[str, List[int]]:
+    """Pick a -live_start_index per track so all captures open on the same segment."""
+    hls_urls = [url for url in urls if ".m3u8" in url]
+    if not urls or len(hls_urls) != len(urls):
+        return "pts", None
+    try:
+        playlists = await asyncio.gather(*(asyncio.to_thread(fetch_playlist, url) for url in urls))
+    except Exception as e:
+        logger.warning(f"Could not fetch playlists for synchronization: {e}")
+        return "pts", None
+    # Variant URLs of a master resolve to media playlists; a master itself has no segments
+    return align_playlists(playlists)
+
+def get_stream_start_time(file_path: str) -> float:
+    """Return the first presentation timestamp (seconds) of a captured file."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=start_time', '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    return float(result.stdout.decode().strip())
+
+async def align_and_trim(raw_files: List[str], muxed_files: List[str], duration: int, job_id: str = None,
+                         preset: str = None):
+    """Cut every capture to the latest common start and the exact duration.
+
+    Stream copies run on the scheduler's copy lane; with a transcode `preset`
+    the video is re-encoded in the CPU-budgeted pool instead.
+    """
+    captured = [(raw, muxed) for raw, muxed in zip(raw_files, muxed_files) if os.path.exists(raw)]
+    starts = {}
+    for raw, _ in captured:
+        try:
+            starts[raw] = await asyncio.to_thread(get_stream_start_time, raw)
+        except Exception as e:
+            logger.warning(f"Could not read start time of {raw}, leaving it unaligned: {e}")
+    common_start = max(starts.values(), default=0.0)
+
+    try:
+        for raw, muxed in captured:
+            offset = common_start - starts[raw] if raw in starts else 0.0
+            cmd = [
+                "ffmpeg", "-y", "-ss", f"{offset:.3f}", "-i", raw, "-map", "0", "-c", "copy",
+                "-t", str(duration), "-movflags", "+faststart", muxed,
+            ]
+            run_options = {"job_id": job_id, "progress_file": muxed, "stall_timeout": Config.STALL_TIMEOUT,
+                           "deadline": duration + Config.DEADLINE_GRACE}
+            if preset:
+                await transcode_scheduler.run_transcode(cmd, preset, **run_options)
+            else:
+                await transcode_scheduler.run_copy(cmd, **run_options)
+    finally:
+        for raw in raw_files:
+            if os.path.exists(raw):
+                os.remove(raw)
+
+def recording_variant(link: str, video: int, audio: int) -> str:
+    """Stable name of a video/audio pair: the yt_dlp format ids, or the indices when unknown.
+
+    A muxed variant recorded with its own audio (audio None) is named by its video format alone.
+    """
+    formats = stream_formats.get(link, {})
+    video_formats, audio_formats = formats.get("video", []), formats.get("audio", [])
+    if video is None:
+        video_id = "audio"
+    else:
+        video_id = video_formats[video].get("format_id") if video < len(video_formats) else video
+    if audio is None:
+        return str(video_id)
+    audio_id = audio_formats[audio].get("format_id") if audio < len(audio_formats) else audio
+    return f"{video_id}+{audio_id}"
 
 def get_audio_stream_count(file_path):
     """Get the number of audio streams in the given file."""
@@ -358,199 +2551,630 @@ def get_audio_stream_count(file_path):
         logger.error(f"Error getting audio stream count for {file_path}: {e}")
         return 0  # Return 0 if there's an error
 
-async def start_recording(user_id: int):
+# Function to get video duration
+def get_video_duration(file_path):
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        duration_seconds = float(result.stdout.decode().strip())
+        hours = int(duration_seconds // 3600)
+        minutes = int((duration_seconds % 3600) // 60)
+        seconds = int(duration_seconds % 60)
+        return f"{hours}h {minutes}m {seconds}s"
+    except Exception as e:
+        logger.error(f"Error getting video duration for {file_path}: {e}")
+        return "Unknown Duration"  # In case of error
+
+# Function to get the codec and bitrate of an audio-only recording
+def get_audio_info(file_path):
     try:
-        state = user_states.get(user_id)
+        result = subprocess.check_output([
+            "ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name,bit_rate:format=bit_rate",
+            "-of", "default=noprint_wrappers=1:nokey=1", file_path
+        ]).decode().split()
+        audio_codec = result[0]
+        bitrate = next((value for value in result[1:] if value.isdigit()), None)  # Stream bitrate, else container's
+        return audio_codec, f"{round(int(bitrate) / 1000)}kbps" if bitrate else "Unknown"
+    except Exception as e:
+        logger.error(f"Error getting audio info for {file_path}: {e}")
+        return "Unknown", "Unknown"
+
+# Function to get video resolution, audio bitrate, and video bitrate using ffprobe
+def get_media_info(file_path):
+    try:
+        # Get video resolution using ffprobe
+        video_resolution_cmd = [
+            "ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height", 
+            "-of", "default=noprint_wrappers=1:nokey=1", file_path
+        ]
+        resolution = subprocess.check_output(video_resolution_cmd).decode().strip().split("\n")
+        width, height = resolution[0], resolution[1]
+        resolution_str = f"{height}p"  # For example, 480p, 1080p
+
+        audio_codec_cmd = [
+            "ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name", 
+            "-of", "default=noprint_wrappers=1:nokey=1", file_path
+        ]
+        audio_codec = subprocess.check_output(audio_codec_cmd).decode().strip()
+
+        video_codec_cmd = [
+            "ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=codec_name", 
+            "-of", "default=noprint_wrappers=1:nokey=1", file_path
+        ]
+        video_codec = subprocess.check_output(video_codec_cmd).decode().strip()
+
+        # Get audio bitrate using ffprobe
+        audio_bitrate_cmd = [
+            "ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=bit_rate", 
+            "-of", "default=noprint_wrappers=1:nokey=1", file_path
+        ]
+        audio_bitrate = subprocess.check_output(audio_bitrate_cmd).decode().strip()
+        audio_bitrate = int(audio_bitrate) / 1000  # Convert to kbps
+        audio_bitrate = round(audio_bitrate)  # Round off to nearest integer
+
+        # Get video bitrate using ffprobe
+        video_bitrate_cmd = [
+            "ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=bit_rate", 
+            "-of", "default=noprint_wrappers=1:nokey=1", file_path
+        ]
+        video_bitrate = subprocess.check_output(video_bitrate_cmd).decode().strip()
+        video_bitrate = int(video_bitrate) / 1000  # Convert to kbps
+        video_bitrate = round(video_bitrate)  # Round off to nearest integer
+
+        return resolution_str, audio_codec, video_codec, f"{audio_bitrate}kbps", f"{video_bitrate}kbps"
+    except Exception as e:
+        logger.error(f"Error getting media info for {file_path}: {e}")
+        return "Unknown", "Unknown", "Unknown", "Unknown", "Unknown"
+
+def format_integrity(report: Dict, duration: int) -> str:
+    """Short caption note for a capture with gaps or missing audio; empty when it is clean."""
+    if not report:
+        return ""
+    notes = []
+    coverage = min(report["covered"] / duration, 1.0) if duration else 1.0
+    if coverage < 0.99:
+        notes.append(f"{coverage * 100:.0f}% covered")
+    if report["gaps"]:
+        gaps = report["gaps"]
+        first = ", ".join(f"{int(gap['at'] // 60)}:{int(gap['at'] % 60):02d}" for gap in gaps[:3])
+        notes.append(f"{len(gaps)} gap(s), {sum(gap['length'] for gap in gaps):.0f}s lost at {first}{'…' if len(gaps) > 3 else ''}")
+    if report["audio_missing"]:
+        notes.append("audio missing")
+    return "; ".join(notes)
+
+def slim_formats(link: str) -> Dict[str, List[dict]]:
+    """The parts of stream_formats[link] a resumed job needs, small enough to journal."""
+    keys = ("format_id", "url", "tbr", "abr", "height", "vcodec", "acodec", "language")
+    return {
+        kind: [{key: fmt.get(key) for key in keys} for fmt in formats]
+        for kind, formats in stream_formats.get(link, {}).items()
+    }
+
+def remove_job_files(job_id: str):
+    """Delete a failed job's raw captures and muxed files; nothing will retry them."""
+    for name in os.listdir(DOWNLOADS_DIR):
+        if name.startswith((f"raw_{job_id}_", f"muxed_{job_id}_")):
+            os.remove(os.path.join(DOWNLOADS_DIR, name))
+
+async def start_recording(user_id: int, state: Dict = None):
+    job_id = None
+    try:
+        state = state or user_states.get(user_id)
         if not state:
             logger.error(f"No user state found for user {user_id}.")
             await send_notification(user_id, "Error: No active recording session found.")
             return
 
+        # Backpressure: a live source cannot be paused, so refuse new work while the disk is full
+        free_mb = shutil.disk_usage(DOWNLOADS_DIR).free / (1024 * 1024)
+        if free_mb < Config.MIN_FREE_DISK_MB:
+            waiting = sum(queued + busy for queued, busy in delivery_pipeline.depths().values())
+            logger.warning(f"Refusing recording for user {user_id}: {free_mb:.0f} MB free, {waiting} file(s) in delivery")
+            metrics["rejected_disk_full"] += 1
+            await send_notification(user_id, f"Disk is nearly full ({free_mb:.0f} MB free, {waiting} file(s) still uploading). Try again later.")
+            return
+
         link = state["link"]
         duration = state["duration"]
-        audio_tracks = state.get("audio_selected", [])
+        audio_tracks = list(state.get("audio_selected", []))
+        if state.get("audio_indices") is not None:
+            audio_tracks = [state["audio_indices"][i] for i in audio_tracks]
         video_tracks = list(state.get("video_selected", []))  # Convert to list to allow indexing
-
-        # Step 1: Create a common start time for synchronization
-        start_time = time.time()  # Get the current time in seconds
+        audio_only = state.get("audio_only", False)
+        if audio_only:
+            video_tracks = [None] * len(audio_tracks)
+        pairs = [tuple(pair) for pair in state.get("pairs") or zip(video_tracks, audio_tracks)]
+        # New ingests need fresh format URLs; running ones keep theirs and their (link, video, audio) keys
+        if not state.get("window_start") and not any(
+            ingest.link == link and not ingest.finished.is_set() for ingest in capture_registry.ingests.values()
+        ):
+            pairs = await refresh_stream_formats(link, pairs)
+        # A saturated origin downgrades new ingests; plan, journal and catalog the variant really recorded
+        pairs = [capture_registry.variant_for(link, video, audio) for video, audio in pairs]
+
+        job_id = f"{user_id}-{int(time.time() * 1000)}"
+        while job_id in job_status:  # Batch jobs can start in the same millisecond
+            job_id = f"{job_id}-1"
+        bind_log_context(job_id=job_id, user_id=user_id)
+        window_start = state.get("window_start") or time.time()  # In the past for DVR recordings
+        job = job_status[job_id] = {
+            "user_id": user_id, "link": link, "duration": duration, "state": "capturing",
+            "started": window_start, "window_start": window_start, "pairs": pairs,
+            "title": state.get("title"), "channel": state.get("channel"),
+            "files": [], "uploaded": {}, "fanned_out": {}, "audio_only": audio_only,
+            "batch": state.get("batch"), "epg_window": state.get("epg_window"),
+        }
+        await job_journal.record(job_id, "created", user_id=user_id, link=link, duration=duration,
+                                 window_start=window_start, pairs=pairs, title=job["title"],
+                                 channel=job["channel"], formats=slim_formats(link), audio_only=audio_only,
+                                 epg_window=job["epg_window"])
+
+        # Sources whose codecs don't fit the output container are re-encoded in the transcode pool;
+        # admission is decided now, and a saturated pool means a stream copy rather than a failed job
+        preset = None if audio_only else STREAM_TYPE_PRESETS.get(classify_stream(link))
+        if preset:
+            preset = transcode_scheduler.admit(preset)
+
+        # Step 1: Align every selected track to a common start segment
+        track_urls = list(dict.fromkeys(url for video, audio in pairs for url in ingest_plan(link, video, audio)[0]))
+        if state.get("window_start") and capture_registry.dvr_for(link):
+            sync_method, start_indices = "dvr", None  # Cut from the already running buffer by wall clock
+        else:
+            sync_method, start_indices = await plan_synchronized_start(track_urls)
+        start_index = dict(zip(track_urls, start_indices)) if start_indices else None
+        logger.info(f"Synchronizing {len(pairs)} track(s) for user {user_id} by {sync_method}.")
 
         # Step 2: Create tasks for video and audio processing
         tasks = []
-        output_video_files = []
-        output_audio_files = []
+        raw_files = []
         muxed_files = []  # List to store muxed file paths
 
         if 'master.m3u8' in link:
             # Processing for master.m3u8
             logger.info(f"Processing master.m3u8 for user {user_id}.")
-
-            for i, (video, audio) in enumerate(zip(video_tracks, audio_tracks)):
-                # Combine video and audio streams together
-                muxed_file = os.path.join(DOWNLOADS_DIR, f"muxed_{user_id}_{i}.mp4")
-                cmd = (
-                    f'"ffmpeg" -y -ss {start_time} -i "{link}" '
-                    f"-map 0:v:{video} -map 0:a:{audio} "
-                    f"-c:v copy -c:a copy -t {duration} -movflags +faststart \"{muxed_file}\""
-                )
-                tasks.append(run_command(cmd))
-
         else:
             # Processing for non-master.m3u8
             logger.info(f"Processing non-master.m3u8 for user {user_id}.")
 
-            for i, (video, audio) in enumerate(zip(video_tracks, audio_tracks)):
-                # Combine video and audio streams together
-                muxed_file = os.path.join(DOWNLOADS_DIR, f"muxed_{user_id}_{i}.mp4")
-                cmd = (
-                    f'"ffmpeg" -y -ss {start_time} -i "{link}" '
-                    f"-map 0:v:{video} -map 0:a:{audio} "
-                    f"-c:v copy -c:a copy -t {duration} -movflags +faststart \"{muxed_file}\""
-                )
-                tasks.append(run_command(cmd))
+        window_end = window_start + duration + Config.SYNC_CAPTURE_PADDING
+        for i, (video, audio) in enumerate(pairs):
+            # Combine video and audio streams together, sharing the ingest with anyone recording the same variant
+            raw_file = os.path.join(DOWNLOADS_DIR, f"raw_{job_id}_{i}.ts")
+            muxed_file = os.path.join(DOWNLOADS_DIR, f"muxed_{job_id}_{i}.{'m4a' if audio_only else 'mp4'}")
+            ingest = capture_registry.get_or_start(user_id, link, video, audio, start_index)
+            pairs[i] = (ingest.video, ingest.audio)  # Headroom may have changed since planning
+            job.setdefault("ingests", []).append(ingest.ingest_id)
+            tasks.append(ingest.capture_window(window_start, window_end, raw_file, job_id))
+            raw_files.append(raw_file)
+            muxed_files.append(muxed_file)
 
         # Step 3: Run all tasks in parallel for maximum efficiency
-        await asyncio.gather(*tasks)
-
-        # Step 4: Verify file creation and send notifications
-        for file in os.listdir(DOWNLOADS_DIR):
-            if file.startswith(f"muxed_{user_id}") and file.endswith(".mp4"):
-                file_path = os.path.join(DOWNLOADS_DIR, file)
-                if not os.path.exists(file_path) or os.path.getsize(file_path) < 1 * 512:  # File size < 0.5 KB
-                    logger.error(f"Error: File not created or is too small - {file_path}")
-                    await send_notification(user_id, f"Recording failed: File error - {file_path}")
-                    return
+        reports = await asyncio.gather(*tasks)
+        await align_and_trim(raw_files, muxed_files, duration, job_id, preset)
+
+        # Step 4: Verify file creation and integrity, and send notifications
+        integrity = dict(zip(muxed_files, reports))
+        for file_path in muxed_files:
+            report = integrity[file_path]
+            if not os.path.exists(file_path) or os.path.getsize(file_path) < 1 * 512:  # File size < 0.5 KB
+                logger.error(f"Error: File not created or is too small - {file_path}")
+                await send_notification(user_id, f"Recording failed: File error - {file_path}")
+                job["state"] = "failed"
+                await job_journal.record(job_id, "done", state="failed")
+                remove_job_files(job_id)
+                return
+            if report["covered"] < Config.MIN_COVERAGE * duration:
+                reason = report["dead"] or f"only {report['covered']:.0f}s of {duration}s captured"
+                logger.error(f"Error: Recording {file_path} failed validation - {reason}")
+                await send_notification(user_id, f"Recording failed: the stream was unusable ({reason}).")
+                job["state"] = "failed"
+                await job_journal.record(job_id, "done", state="failed")
+                remove_job_files(job_id)
+                return
 
         logger.info(f"All muxed files created successfully for user {user_id}.")
-
-        # Step 6: Check audio stream count from the generated muxed files
-        for muxed_file in muxed_files:
-            audio_count = get_audio_stream_count(muxed_file)
-            audio_label = "Single-Audio" if audio_count == 1 else "Multi-Audio"
-            logger.info(f"Muxed file {muxed_file} has {audio_count} streams: {audio_label}")
+        job["files"] = muxed_files
+        job["integrity"] = integrity
+        await job_journal.record(job_id, "captured", files=muxed_files, integrity=integrity, pairs=pairs)
 
         # Notify user and handle final files
         logger.info(f"Recording completed for user {user_id}. Files are ready in {DOWNLOADS_DIR}.")
-        await send_notification(user_id, "Recording completed. Uploading files...")
-
-        # Function to get video duration
-        def get_video_duration(file_path):
+        job["state"] = "uploading"
+        usage = job.get("usage")
+        if not job["batch"]:  # Batch jobs report through their batch's status message
+            await send_notification(
+                user_id, f"Recording completed ({format_usage(usage)}). Uploading files..." if usage else "Recording completed. Uploading files..."
+            )
+        await delivery_pipeline.submit(job_id)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        if job_id in job_status and job_status[job_id]["state"] == "capturing":
+            # A terminal state lets batch monitors and /status stop waiting for it
+            job_status[job_id]["state"] = "failed"
+            await job_journal.record(job_id, "done", state="failed")
+            remove_job_files(job_id)  # Only delivery failures keep their files for a retry
+        await send_notification(chat_id, f"An error occurred: {e}")
+    finally:
+        bind_log_context(job_id=None)  # Handlers await this on pyrogram's long-lived worker tasks
+
+class DeliveryPipeline:
+    """Probe, upload and fan-out as independent worker pools joined by bounded queues.
+
+    Every captured file travels through the stages on its own, so one job's
+    slow upload no longer holds up its other files or anyone else's probing
+    and dump-chat copies. When uploads fall behind, the upload queue fills,
+    probe workers block on it, and finally `submit` blocks the job that
+    wants to hand over more files; work waits on disk instead of piling up
+    in memory. Journaling is unchanged, so a file resumes at its last stage.
+    """
+
+    def __init__(self, probe_workers: int, upload_workers: int, fanout_workers: int, queue_size: int):
+        self.sizes = {"probe": probe_workers, "upload": upload_workers, "fanout": fanout_workers}
+        self.queues = {stage: asyncio.Queue(queue_size) for stage in self.sizes}
+        self.busy = defaultdict(int)
+        self._tasks = []
+
+    def start(self):
+        handlers = {"probe": self._probe, "upload": self._upload, "fanout": self._fanout}
+        loop = asyncio.get_running_loop()
+        for stage, count in self.sizes.items():
+            for _ in range(count):
+                self._tasks.append(loop.create_task(self._worker(stage, handlers[stage])))
+
+    def depths(self) -> Dict[str, Tuple[int, int]]:
+        """(queued, in progress) per stage."""
+        return {stage: (queue.qsize(), self.busy[stage]) for stage, queue in self.queues.items()}
+
+    async def submit(self, job_id: str):
+        """Queue a job's captured files, skipping anything already journaled."""
+        job = job_status[job_id]
+        files = [(i, path) for i, path in enumerate(job["files"]) if path in job["uploaded"] or os.path.exists(path)]
+        job["pending"] = len(files)
+        job["delivery_failed"] = False
+        if not files:
+            await self._finish(job_id)
+            return
+        for i, muxed_file in files:
+            item = {"job_id": job_id, "index": i, "file": muxed_file}
+            uploaded = job["uploaded"].get(muxed_file)
+            if uploaded:
+                item["message_id"] = uploaded["message_id"]
+                await self.queues["fanout"].put(item)
+            else:
+                await self.queues["probe"].put(item)
+
+    async def _worker(self, stage: str, handle):
+        queue = self.queues[stage]
+        while True:
+            item = await queue.get()
+            job = job_status[item["job_id"]]
+            bind_log_context(job_id=item["job_id"], user_id=job["user_id"])
+            self.busy[stage] += 1
             try:
-                result = subprocess.run(
-                    ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-                duration_seconds = float(result.stdout.decode().strip())
-                hours = int(duration_seconds // 3600)
-                minutes = int((duration_seconds % 3600) // 60)
-                seconds = int(duration_seconds % 60)
-                return f"{hours}h {minutes}m {seconds}s"
+                await handle(item, job)
             except Exception as e:
-                logger.error(f"Error getting video duration for {file_path}: {e}")
-                return "Unknown Duration"  # In case of error
-
-        # Upload the muxed files
-        for muxed_file in muxed_files:
-            if os.path.exists(muxed_file):
-                try:
-                    file_size = os.path.getsize(muxed_file)
-                    file_name = os.path.basename(muxed_file)
-                    duration = get_video_duration(muxed_file)
-
-                    user_state = user_states.get(user_id)
-                    if user_state:
-                        title = user_state.get("title")
-                        channel = user_state.get("channel")
-
-                        # Function to get video resolution, audio bitrate, and video bitrate using ffprobe
-                        def get_media_info(file_path):
-                            try:
-                                # Get video resolution using ffprobe
-                                video_resolution_cmd = [
-                                    "ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height", 
-                                    "-of", "default=noprint_wrappers=1:nokey=1", file_path
-                                ]
-                                resolution = subprocess.check_output(video_resolution_cmd).decode().strip().split("\n")
-                                width, height = resolution[0], resolution[1]
-                                resolution_str = f"{height}p"  # For example, 480p, 1080p
-
-                                audio_codec_cmd = [
-                                    "ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name", 
-                                    "-of", "default=noprint_wrappers=1:nokey=1", file_path
-                                ]
-                                audio_codec = subprocess.check_output(audio_codec_cmd).decode().strip()
-
-                                video_codec_cmd = [
-                                    "ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=codec_name", 
-                                    "-of", "default=noprint_wrappers=1:nokey=1", file_path
-                                ]
-                                video_codec = subprocess.check_output(video_codec_cmd).decode().strip()
-
-                                # Get audio bitrate using ffprobe
-                                audio_bitrate_cmd = [
-                                    "ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=bit_rate", 
-                                    "-of", "default=noprint_wrappers=1:nokey=1", file_path
-                                ]
-                                audio_bitrate = subprocess.check_output(audio_bitrate_cmd).decode().strip()
-                                audio_bitrate = int(audio_bitrate) / 1000  # Convert to kbps
-                                audio_bitrate = round(audio_bitrate)  # Round off to nearest integer
-
-                                # Get video bitrate using ffprobe
-                                video_bitrate_cmd = [
-                                    "ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=bit_rate", 
-                                    "-of", "default=noprint_wrappers=1:nokey=1", file_path
-                                ]
-                                video_bitrate = subprocess.check_output(video_bitrate_cmd).decode().strip()
-                                video_bitrate = int(video_bitrate) / 1000  # Convert to kbps
-                                video_bitrate = round(video_bitrate)  # Round off to nearest integer
-
-                                return resolution_str, audio_codec, video_codec, f"{audio_bitrate}kbps", f"{video_bitrate}kbps"
-                            except Exception as e:
-                                logger.error(f"Error getting media info for {file_path}: {e}")
-                                return "Unknown", "Unknown", "Unknown", "Unknown", "Unknown"
-
-                        # Extract details for each muxed file
-                        resolution, audio_codec, video_codec, audio_bitrate, video_bitrate = get_media_info(muxed_file)
-
-                        # Generate the caption with dynamic title, channel, and credits
-                        caption = (
-                            f"<b>File-Name:</b> <code>[{Config.CREDITS}].{title}.{channel}.{resolution}.{video_codec}.{video_bitrate}.IPTV.WEB-DL.{audio_label}.{audio_codec}.{audio_bitrate}.mp4</code>\n"
-                            f"<b>Duration:</b> <code>{duration}</code>"
-                        )
-
-                        # Send the video file to Telegram
-                        video_message = await bot.send_video(
-                            chat_id=chat_id,
-                            video=open(muxed_file, 'rb'),
-                            caption=caption,
-                        )
-                        logger.info(f"Video uploaded successfully for user {user_id}.")
-
-                    if hasattr(video_message, 'id'):
-                        await bot.copy_message(
-                            chat_id=dump_chat_id,
-                            from_chat_id=chat_id,
-                            message_id=video_message.id   # The ID of the message to copy
-                        )
-                        logger.info(f"Video forwarded successfully for user {user_id} to dump chat {dump_chat_id}.")
+                logger.error(f"Error during {stage} of {item['file']}: {e}")
+                await send_notification(chat_id, f"Upload failed: {e}")
+                job["delivery_failed"] = True
+                await self._file_done(item["job_id"])
+            finally:
+                self.busy[stage] -= 1
+                queue.task_done()
+
+    async def _probe(self, item: Dict, job: Dict):
+        """Read the file's media details and build its caption."""
+        muxed_file = item["file"]
+        title, channel = job["title"], job["channel"]
+        file_size = os.path.getsize(muxed_file)
+        if file_size > bot.upload_limit:
+            # Refuse before probing or queueing an upload Telegram would reject anyway
+            raise ValueError(f"{os.path.basename(muxed_file)} is {file_size / (1024 * 1024):.0f} MiB, "
+                             f"over Telegram's {bot.upload_limit // (1024 * 1024)} MiB limit")
+        duration = await asyncio.to_thread(get_video_duration, muxed_file)
+
+        # Check audio stream count of the muxed file
+        audio_count = await asyncio.to_thread(get_audio_stream_count, muxed_file)
+        audio_label = "Single-Audio" if audio_count == 1 else "Multi-Audio"
+        logger.info(f"Muxed file {muxed_file} has {audio_count} streams: {audio_label}")
+
+        # Extract details for each muxed file
+        if job.get("audio_only", False):
+            resolution, video_codec, video_bitrate = None, None, None
+            audio_codec, audio_bitrate = await asyncio.to_thread(get_audio_info, muxed_file)
+            file_name = f"[{Config.CREDITS}].{title}.{channel}.IPTV.WEB-DL.{audio_label}.{audio_codec}.{audio_bitrate}.m4a"
+        else:
+            resolution, audio_codec, video_codec, audio_bitrate, video_bitrate = await asyncio.to_thread(
+                get_media_info, muxed_file
+            )
+            file_name = f"[{Config.CREDITS}].{title}.{channel}.{resolution}.{video_codec}.{video_bitrate}.IPTV.WEB-DL.{audio_label}.{audio_codec}.{audio_bitrate}.mp4"
 
-                        await bot.copy_message(
-                            chat_id=dump_other_chat_id,
-                            from_chat_id=chat_id,
-                            message_id=video_message.id   # The ID of the message to copy
+        # Generate the caption with dynamic title, channel, and credits
+        caption = (
+            f"<b>File-Name:</b> <code>{file_name}</code>\n"
+            f"<b>Duration:</b> <code>{duration}</code>"
+        )
+        integrity_note = format_integrity(job.get("integrity", {}).get(muxed_file), job["duration"])
+        if integrity_note:
+            caption += f"\n<b>Integrity:</b> <code>{integrity_note}</code>"
+
+        item["caption"] = caption
+        item["metadata"] = {
+            "caption": caption, "duration": duration, "resolution": resolution,
+            "video_codec": video_codec, "video_bitrate": video_bitrate,
+            "audio_codec": audio_codec, "audio_bitrate": audio_bitrate,
+            "file_size": file_size,
+        }
+        await self.queues["upload"].put(item)
+
+    async def _upload(self, item: Dict, job: Dict):
+        """Send the file to Telegram, reusing an earlier upload of the same window if there is one."""
+        job_id, muxed_file, caption = item["job_id"], item["file"], item["caption"]
+        user_id, link = job["user_id"], job["link"]
+        title, channel = job["title"], job["channel"]
+        window_start = job["window_start"]
+        recorded_end = window_start + job["duration"]
+        audio_only = job.get("audio_only", False)
+
+        variant = recording_variant(link, *job["pairs"][item["index"]])
+        async with recording_catalog.lock(link, variant):
+            existing = await recording_catalog.find_covering(link, variant, window_start, recorded_end)
+            if existing:
+                # file_ids belong to the bot that uploaded them
+                uploader = client_pool.by_name(json.loads(existing["metadata"] or "{}").get("client", bot.name))
+                if audio_only:
+                    video_message = await uploader.send_audio(chat_id=chat_id, audio=existing["file_id"], caption=caption)
+                else:
+                    video_message = await uploader.send_video(chat_id=chat_id, video=existing["file_id"], caption=caption)
+                metrics["file_id_reuses"] += 1
+                logger.info(f"Reused recording #{existing['id']} for user {user_id}.")
+            else:
+                async def upload(client, path=muxed_file, caption=caption):
+                    if audio_only:
+                        return client.name, await upload_engine.send_audio(
+                            client, chat_id, path, caption, notify_chat=user_id, title=title, performer=channel
                         )
-                        logger.info(f"Video forwarded successfully for user {user_id} to dump chat {dump_other_chat_id}.")
-                        
-                except Exception as e:
-                    logger.error(f"Error during upload: {e}")
-                    await send_notification(chat_id, f"Upload failed: {e}")
+                    return client.name, await upload_engine.send_video(
+                        client, chat_id, path, caption, notify_chat=user_id
+                    )
 
-        # Cleanup
+                uploader, video_message = await client_pool.run(upload)
+                logger.info(f"Video uploaded successfully for user {user_id} via {uploader}.")
+                metadata = {"client": uploader, **item["metadata"]}
+                await recording_catalog.add(
+                    link, variant, window_start, recorded_end, title, channel, metadata, video_message
+                )
+        item["message_id"] = video_message.id
+        job["uploaded"][muxed_file] = {"chat_id": chat_id, "message_id": video_message.id}
+        await job_journal.record(job_id, "uploaded", file=muxed_file, chat_id=chat_id, message_id=video_message.id)
+        await self.queues["fanout"].put(item)
+
+    async def _fanout(self, item: Dict, job: Dict):
+        """Copy the uploaded message to the dump chats not journaled yet."""
+        job_id, muxed_file = item["job_id"], item["file"]
+        fanned_out = job["fanned_out"].setdefault(muxed_file, [])
+        for dump in (dump_chat_id, dump_other_chat_id):
+            if dump in fanned_out:
+                continue
+            await client_pool.run(lambda client, dump=dump: client.copy_message(
+                chat_id=dump,
+                from_chat_id=chat_id,
+                message_id=item["message_id"]   # The ID of the message to copy
+            ))
+            fanned_out.append(dump)
+            await job_journal.record(job_id, "fanned_out", file=muxed_file, chat_id=dump)
+            logger.info(f"Video forwarded successfully for user {job['user_id']} to dump chat {dump}.")
+        # Uploaded and fanned out per the journal: the local copy is no longer needed
+        if os.path.exists(muxed_file):
+            os.remove(muxed_file)
+        await self._file_done(job_id)
+
+    async def _file_done(self, job_id: str):
+        job = job_status[job_id]
+        job["pending"] -= 1
+        if job["pending"] == 0:
+            await self._finish(job_id)
+
+    async def _finish(self, job_id: str):
+        job = job_status[job_id]
+        if job["delivery_failed"]:
+            # Not journaled as done, so the next start retries what is missing
+            job["state"] = "upload_failed"
+            return
+        job["state"] = "done"
+        await job_journal.record(job_id, "done", state="done")
+        for path in job["files"]:
+            if os.path.exists(path):
+                os.remove(path)
         logger.info("Cleanup completed.")
         await send_notification(chat_id, "Files uploaded and cleanup done.")
+
+delivery_pipeline = DeliveryPipeline(
+    Config.PROBE_WORKERS, Config.MAX_CONCURRENT_UPLOADS, Config.FANOUT_WORKERS, Config.PIPELINE_QUEUE_SIZE
+)
+
+async def resume_jobs():
+    """Finish what the journal says was interrupted by the last shutdown or crash."""
+    pending = await job_journal.replay()
+    await asyncio.to_thread(kill_orphaned_ingests)
+    for job_id, job in pending.items():
+        if job.get("formats") and job["link"] not in stream_formats:
+            stream_formats[job["link"]] = job["formats"]
+        job.setdefault("state", "capturing")
+        job_status[job_id] = job
+        if job.get("epg_window"):
+            # The scheduler's plan died with the old process; without this it would record the programme again
+            epg_planned[(job["user_id"], job["link"])].append(tuple(job["epg_window"]))
+        if job["files"]:
+            # Captured before the crash: upload what wasn't sent, fan out what wasn't copied
+            logger.info(f"Resuming delivery of job {job_id}")
+            job["state"] = "uploading"
+            asyncio.get_running_loop().create_task(delivery_pipeline.submit(job_id))
+            continue
+
+        remaining = job["window_start"] + job["duration"] - time.time()
+        await job_journal.record(job_id, "done", state="superseded")
+        job["state"] = "superseded"
+        if remaining < 5:
+            await send_notification(job["user_id"], f"Recording of {job['title']} was interrupted by a restart and its window has passed.")
+            continue
+        logger.info(f"Restarting capture of job {job_id} for the remaining {remaining:.0f}s")
+        await send_notification(job["user_id"], f"Recording of {job['title']} was interrupted by a restart; resuming for the remaining {remaining / 60:.0f} min.")
+        state = {"link": job["link"], "duration": int(remaining), "pairs": job["pairs"],
+                 "title": job["title"], "channel": job["channel"], "audio_only": job.get("audio_only", False),
+                 "epg_window": job.get("epg_window")}
+        asyncio.get_running_loop().create_task(start_recording(job["user_id"], state))
+
+async def run_dvr_buffers():
+    """Keep a DVR buffer running for every channel in DVR_CHANNELS, restarting any that die."""
+    while True:
+        for entry in Config.DVR_CHANNELS:
+            link = entry if re.match(r"https?://", entry) else channel_index.resolve(entry)
+            if not link or capture_registry.dvr_for(link):
+                continue  # Not in the catalog yet, or already buffering
+            try:
+                await refresh_stream_formats(link)
+                audio, video, _ = await auto_select_streams(link)
+                if not video:
+                    logger.warning(f"DVR: no usable variant for {entry}")
+                    continue
+                capture_registry.start_dvr(link, next(iter(video)), next(iter(audio)))
+            except Exception as e:
+                logger.error(f"DVR: could not start buffer for {entry}: {e}")
+        await asyncio.sleep(30)
+
+def plan_epg_capture(rule: Dict, first: Dict, pattern) -> Tuple[float, float, List[Dict]]:
+    """Padded window for `first` and every following match whose padded window touches it.
+
+    Back-to-back matches (a double bill, the second half after a break)
+    become one capture instead of two overlapping ones.
+    """
+    chain, end = [first], first["stop"]
+    gap = Config.EPG_PADDING_BEFORE + Config.EPG_PADDING_AFTER
+    while True:
+        following = [
+            programme for programme in epg_index.overlapping(rule["channel"], end, end + gap)
+            if programme["start"] >= chain[-1]["start"] and programme not in chain and pattern.search(programme["title"])
+        ]
+        if not following:
+            break
+        chain.append(following[0])
+        end = max(end, following[0]["stop"])
+    return first["start"] - Config.EPG_PADDING_BEFORE, end + Config.EPG_PADDING_AFTER, chain
+
+async def start_epg_recording(rule: Dict, link: str, start: float, end: float, chain: List[Dict]):
+    """Wait for a planned window, pick streams and record it like a /record job."""
+    await asyncio.sleep(max(start - time.time(), 0))
+    user_id = rule["user_id"]
+    bind_log_context(job_id=None, user_id=user_id)
+    title = re.sub(r"\s+", ".", " + ".join(programme["title"] for programme in chain))
+    state = {"link": link, "title": title, "channel": rule["channel"], "audio_only": rule["audio_only"],
+             "epg_window": (start, end)}
+    buffer = capture_registry.dvr_for(link)
+    try:
+        if buffer is not None and start < time.time():
+            # Late start (e.g. after a restart): take the missed minutes from the DVR buffer
+            state.update(pairs=[(buffer.video, buffer.audio)], window_start=max(start, buffer.oldest),
+                         audio_only=buffer.video is None)
+        else:
+            await refresh_stream_formats(link)
+            if rule["audio_only"]:
+                audio_formats = stream_formats.get(link, {}).get("audio", [])
+                candidates = audio_only_indices(link)
+                audio = {max(candidates, key=lambda i: audio_formats[i].get("abr") or 0)} if candidates else set()
+                video = set()
+            else:
+                audio, video, _ = await auto_select_streams(link)
+            if not audio or (not video and not rule["audio_only"]):
+                await send_notification(user_id, f"Auto-record #{rule['id']}: no usable streams for {rule['channel']}.")
+                return
+            state.update(audio_selected=audio, video_selected=set() if rule["audio_only"] else video)
+        state["duration"] = int(end - (state.get("window_start") or time.time()))
+        await send_notification(user_id, f"Auto-recording {' + '.join(p['title'] for p in chain)} on {rule['channel']} (rule #{rule['id']})...")
+        await start_recording(user_id, state)
     except Exception as e:
-        logger.error(f"Error: {e}")
-        await send_notification(chat_id, f"An error occurred: {e}")
+        logger.error(f"EPG rule #{rule['id']} failed: {e}")
+        await send_notification(user_id, f"Auto-record #{rule['id']} failed: {e}")
+
+# (user_id, link) -> windows the EPG scheduler has started or planned, including those resumed from the journal
+epg_planned: Dict[Tuple[int, str], List[Tuple[float, float]]] = defaultdict(list)
+
+async def run_epg_scheduler():
+    """Start captures for rule matches about to air; each match is looked up in O(log n) per channel."""
+    planned = epg_planned
+    while True:
+        now = time.time()
+        for key in list(planned):
+            planned[key] = [(start, end) for start, end in planned[key] if end > now]
+        for rule in list(epg_rules.rules):
+            try:
+                link = channel_index.resolve(rule["channel"])
+                if not link:
+                    continue
+                pattern = re.compile(rule["pattern"], re.IGNORECASE)
+                horizon = now + Config.EPG_LOOKAHEAD + Config.EPG_PADDING_BEFORE
+                for programme in epg_index.overlapping(rule["channel"], now, horizon):
+                    key = (rule["user_id"], link)
+                    if not pattern.search(programme["title"]) or any(
+                        start <= programme["start"] and programme["stop"] <= end for start, end in planned[key]
+                    ):
+                        continue  # Covered by a capture already planned
+                    start, end, chain = plan_epg_capture(rule, programme, pattern)
+                    planned[key].append((chain[0]["start"], chain[-1]["stop"]))
+                    logger.info(f"EPG rule #{rule['id']}: scheduling {len(chain)} programme(s) on {rule['channel']} "
+                                f"from {datetime.fromtimestamp(start)} to {datetime.fromtimestamp(end)}")
+                    metrics["epg_recordings"] += 1
+                    asyncio.get_running_loop().create_task(start_epg_recording(rule, link, start, end, chain))
+            except Exception as e:
+                logger.error(f"EPG rule #{rule.get('id')} could not be scheduled: {e}")
+        await asyncio.sleep(30)
+
+def kill_orphaned_ingests():
+    """Kill ffmpeg processes from a previous run that are still writing into an ingest directory."""
+    ingest_root = os.path.join(os.path.abspath(DOWNLOADS_DIR), "ingest-")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+        except OSError:
+            continue
+        if ingest_root in cmdline or f" {os.path.join(DOWNLOADS_DIR, 'ingest-')}" in cmdline:
+            logger.warning(f"Killing orphaned ingest process {entry}")
+            try:
+                os.killpg(int(entry), signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+    for name in os.listdir(DOWNLOADS_DIR):
+        if name.startswith("ingest-"):
+            shutil.rmtree(os.path.join(DOWNLOADS_DIR, name), ignore_errors=True)
+
+async def main():
+    if blocking_detector is not None:
+        blocking_detector.install()
+    await bot.start()
+    await client_pool.start()
+    delivery_pipeline.start()
+    channel_catalog.start()
+    process_tracker.start()
+    loop_lag.start()
+    await resume_jobs()
+    if Config.DVR_CHANNELS:
+        asyncio.get_running_loop().create_task(run_dvr_buffers())
+    if Config.EPG_SOURCE:
+        epg_guide.start()
+        asyncio.get_running_loop().create_task(run_epg_scheduler())
+    await idle()
+    await client_pool.stop()
+    await bot.stop()
+    if blocking_detector is not None:
+        blocking_detector.uninstall()
+        logger.warning(blocking_detector.report())
+    log_listener.stop()
 
 # Start bot
-bot.run()
+if __name__ == "__main__":
+    bot.run(main())
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+from main import parse_batch_document, parse_batch_duration, parse_batch_start, validate_batch_row
+
+NOW = datetime(2024, 6, 1, 12, 0, 0).timestamp()
+
+def test_parse_batch_document_csv_numbers_rows_by_file_line():
+    data = b"\xef\xbb\xbflink,title,duration\nhttp://a/x.m3u8,Match,01:30:00\nhttp://b/y.m3u8,News,600\n"
+    rows = parse_batch_document("jobs.CSV", data)
+    assert [(row["line"], row["title"], row["duration"]) for row in rows] == [(2, "Match", "01:30:00"), (3, "News", "600")]
+
+def test_parse_batch_document_jsonl_reports_bad_lines():
+    data = b'{"link": "http://a/x.m3u8", "title": "Match"}\n\nnot json\n[1, 2]\n'
+    rows = parse_batch_document("jobs.jsonl", data)
+    assert rows[0] == {"link": "http://a/x.m3u8", "title": "Match", "line": 1}
+    assert rows[1]["line"] == 3 and rows[1]["error"].startswith("invalid JSON")
+    assert rows[2] == {"error": "not a JSON object", "line": 4}
+
+def test_parse_batch_duration():
+    assert parse_batch_duration("600") == 600
+    assert parse_batch_duration(" 01:30:05 ") == 5405
+    with pytest.raises(ValueError):
+        parse_batch_duration("90 minutes")
+
+def test_parse_batch_start():
+    assert parse_batch_start("", NOW) == NOW
+    assert parse_batch_start("NOW", NOW) == NOW
+    assert parse_batch_start("1717250000", NOW) == 1717250000.0
+    assert parse_batch_start("18:30", NOW) == datetime(2024, 6, 1, 18, 30).timestamp()
+    assert parse_batch_start("2024-06-02T08:00:00", NOW) == datetime(2024, 6, 2, 8, 0).timestamp()
+    with pytest.raises(ValueError):
+        parse_batch_start("tomorrow", NOW)
+
+def test_validate_batch_row_builds_the_job_spec():
+    row = {"link": "https://cdn.example.com/live.m3u8", "title": "Cup  Final", "channel": "Sports 1",
+           "duration": "01:00:00", "start": "13:00", "mode": "audio", "line": 2}
+    spec, errors = validate_batch_row(row, NOW)
+    assert errors == []
+    assert spec == {
+        "line": 2, "link": "https://cdn.example.com/live.m3u8", "title": "Cup.Final", "channel": "Sports.1",
+        "start": datetime(2024, 6, 1, 13, 0).timestamp(), "duration": 3600, "audio_only": True,
+        "video": "auto", "audio": "best",
+    }
+
+def test_validate_batch_row_collects_every_problem():
+    row = {"link": "https://cdn.example.com/live.m3u8", "duration": "soon", "start": "09:00", "mode": "radio", "line": 5}
+    _, errors = validate_batch_row(row, NOW)
+    assert errors == [
+        "missing title",
+        "invalid duration 'soon' (use hh:mm:ss or seconds)",
+        "unknown mode 'radio'",
+        "start 09:00 has already passed",
+    ]
+
+def test_validate_batch_row_rejects_unknown_channels_and_parse_errors():
+    _, errors = validate_batch_row({"channel": "No Such Channel", "title": "X", "duration": "60", "line": 3}, NOW)
+    assert errors == ["unknown channel 'No Such Channel'"]
+    assert validate_batch_row({"error": "not a JSON object", "line": 4}, NOW) == ({}, ["not a JSON object"])
+    _, errors = validate_batch_row({"title": "X", "duration": "0", "line": 6}, NOW)
+    assert errors == ["missing link", "duration must be positive"]
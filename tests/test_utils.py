@@ -0,0 +1,162 @@
+import pytest
+
+from utils import EPGIndex, TSValidator, align_playlists, parse_m3u8, PTS_CLOCK, PTS_WRAP, TS_PACKET_SIZE
+
+VIDEO_PID, AUDIO_PID, PMT_PID = 0x100, 0x101, 0x1000
+
+def ts_packet(pid, payload, counter=0, unit_start=True):
+    header = bytes([0x47, (0x40 if unit_start else 0) | (pid >> 8), pid & 0xFF, 0x10 | (counter & 0x0F)])
+    return (header + payload).ljust(TS_PACKET_SIZE, b"\xff")
+
+def psi(table_id, body):
+    length = len(body) + 4  # Plus the CRC, which the validator does not check
+    return bytes([0, table_id, 0xB0 | (length >> 8), length & 0xFF]) + body + b"\x00" * 4
+
+def pat():
+    return ts_packet(0, psi(0x00, bytes([0, 1, 0xC1, 0, 0, 0, 1, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF])))
+
+def pmt():
+    streams = bytes([0x1B, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0,
+                     0x0F, 0xE0 | (AUDIO_PID >> 8), AUDIO_PID & 0xFF, 0xF0, 0])
+    return ts_packet(PMT_PID, psi(0x02, bytes([0, 1, 0xC1, 0, 0, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0]) + streams))
+
+def pes(pid, pts, counter):
+    pts %= PTS_WRAP
+    field = bytes([0x21 | ((pts >> 29) & 0x0E), (pts >> 22) & 0xFF, ((pts >> 14) & 0xFE) | 1,
+                   (pts >> 7) & 0xFF, ((pts << 1) & 0xFE) | 1])
+    return ts_packet(pid, b"\x00\x00\x01\xe0\x00\x00\x80\x80\x05" + field + b"\x00" * 8, counter)
+
+def stream(pid, seconds, counters=None):
+    counters = counters or range(len(seconds))
+    return pat() + pmt() + b"".join(pes(pid, int(s * PTS_CLOCK), cc) for s, cc in zip(seconds, counters))
+
+def test_ts_validator_measures_coverage_and_tracks():
+    report = TSValidator().feed(stream(VIDEO_PID, [10.0, 10.5, 11.0, 11.5]))
+    assert report["video"] == pytest.approx(1.5)
+    assert report["audio"] == 0.0
+    assert report["audio_tracks"] == 1
+    assert report["gaps"] == [] and report["cc_errors"] == 0
+
+def test_ts_validator_continuity_counter_wraps():
+    report = TSValidator().feed(stream(VIDEO_PID, [0, 0.5, 1.0, 1.5], counters=[14, 15, 0, 1]))
+    assert report["cc_errors"] == 0
+
+def test_ts_validator_counts_skipped_continuity_counters():
+    report = TSValidator().feed(stream(VIDEO_PID, [0, 0.5, 1.0], counters=[3, 4, 6]))
+    assert report["cc_errors"] == 1
+
+def test_ts_validator_counter_state_carries_across_segments():
+    validator = TSValidator()
+    validator.feed(stream(VIDEO_PID, [0, 0.5], counters=[0, 1]))
+    report = validator.feed(b"".join(pes(VIDEO_PID, int(s * PTS_CLOCK), cc) for s, cc in [(1.0, 2), (1.5, 5)]))
+    assert report["cc_errors"] == 1
+    assert report["video"] == pytest.approx(1.0)
+
+def test_ts_validator_pts_rollover_is_not_a_gap():
+    wrap = PTS_WRAP / PTS_CLOCK
+    report = TSValidator().feed(stream(VIDEO_PID, [wrap - 1.0, wrap - 0.5, wrap, wrap + 0.5]))
+    assert report["video"] == pytest.approx(1.5)
+    assert report["gaps"] == []
+
+def test_ts_validator_reports_timestamp_gaps():
+    report = TSValidator(gap_threshold=1.0).feed(stream(VIDEO_PID, [0, 0.5, 5.5, 6.0]))
+    assert report["gaps"] == [{"kind": "video", "at": pytest.approx(0.5), "length": pytest.approx(5.0)}]
+    assert report["video"] == pytest.approx(1.0)
+
+MASTER = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",LANGUAGE="en",NAME="English",URI="audio/en.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=1280000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2",AUDIO="aud"
+720p/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=640000,RESOLUTION=640x360
+https://cdn.example.com/360p.m3u8
+"""
+
+def media_playlist(sequence, count, program_date_time=None, duration=2.0):
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2", f"#EXT-X-MEDIA-SEQUENCE:{sequence}"]
+    if program_date_time:
+        lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{program_date_time}")
+    for i in range(count):
+        lines += [f"#EXTINF:{duration},", f"seg{sequence + i}.ts"]
+    return "\n".join(lines) + "\n"
+
+def test_parse_m3u8_master():
+    playlist = parse_m3u8(MASTER, "https://example.com/live/master.m3u8")
+    assert [variant["URI"] for variant in playlist["variants"]] == [
+        "https://example.com/live/720p/index.m3u8", "https://cdn.example.com/360p.m3u8",
+    ]
+    assert playlist["variants"][0]["CODECS"] == "avc1.4d401f,mp4a.40.2"
+    assert playlist["variants"][0]["RESOLUTION"] == "1280x720"
+    assert playlist["media"][0]["URI"] == "https://example.com/live/audio/en.m3u8"
+    assert playlist["media"][0]["LANGUAGE"] == "en"
+    assert playlist["segments"] == []
+
+def test_parse_m3u8_media_playlist_carries_program_date_time_forward():
+    text = media_playlist(100, 3, "2024-01-01T00:00:00Z") + "#EXT-X-ENDLIST\n"
+    playlist = parse_m3u8(text, "https://example.com/live/720p/index.m3u8")
+    assert playlist["media_sequence"] == 100 and playlist["target_duration"] == 2.0 and playlist["endlist"]
+    assert [seg["sequence"] for seg in playlist["segments"]] == [100, 101, 102]
+    assert playlist["segments"][0]["uri"] == "https://example.com/live/720p/seg100.ts"
+    first = playlist["segments"][0]["program_date_time"]
+    assert [seg["program_date_time"] - first for seg in playlist["segments"]] == [0.0, 2.0, 4.0]
+
+def test_parse_m3u8_without_program_date_time():
+    playlist = parse_m3u8(media_playlist(7, 2), "https://example.com/a.m3u8")
+    assert all("program_date_time" not in seg for seg in playlist["segments"])
+
+def pdt_playlist(sequence, count, start):
+    return parse_m3u8(media_playlist(sequence, count, start), "https://example.com/a.m3u8")
+
+def test_align_playlists_by_program_date_time():
+    video = pdt_playlist(10, 5, "2024-01-01T00:00:00Z")  # 00:00 .. 00:08
+    audio = pdt_playlist(50, 4, "2024-01-01T00:00:00Z")  # 00:00 .. 00:06, one segment behind
+    method, indices = align_playlists([video, audio])
+    assert method == "program-date-time"
+    assert indices == [-2, -1]
+    assert video["segments"][indices[0]]["program_date_time"] == audio["segments"][indices[1]]["program_date_time"]
+
+def test_align_playlists_by_media_sequence():
+    video = parse_m3u8(media_playlist(10, 5), "https://example.com/v.m3u8")  # 10 .. 14
+    audio = parse_m3u8(media_playlist(9, 4), "https://example.com/a.m3u8")   # 9 .. 12
+    method, indices = align_playlists([video, audio])
+    assert method == "media-sequence"
+    assert indices == [-3, -1]
+    assert video["segments"][indices[0]]["sequence"] == audio["segments"][indices[1]]["sequence"] == 12
+
+def test_align_playlists_falls_back_to_pts():
+    video = parse_m3u8(media_playlist(100, 3), "https://example.com/v.m3u8")
+    audio = parse_m3u8(media_playlist(1, 3), "https://example.com/a.m3u8")
+    assert align_playlists([video, audio]) == ("pts", None)
+    assert align_playlists([video, parse_m3u8(MASTER, "https://example.com/m.m3u8")]) == ("pts", None)
+    assert align_playlists([]) == ("pts", None)
+
+def programme(start, stop, title):
+    return {"channel": "bbc1", "start": start, "stop": stop, "title": title}
+
+@pytest.fixture
+def epg():
+    return EPGIndex({
+        "channels": {"bbc1": ["BBC One"]},
+        "programmes": [
+            programme(200, 300, "Film"), programme(0, 100, "Marathon"), programme(10, 20, "News"),
+            programme(100, 200, "Quiz"), programme(150, 150, "Empty"),
+        ],
+    })
+
+def titles(programmes):
+    return [p["title"] for p in programmes]
+
+def test_epg_index_overlap_includes_long_earlier_programmes(epg):
+    assert titles(epg.overlapping("bbc1", 15, 16)) == ["Marathon", "News"]
+
+def test_epg_index_overlap_is_half_open(epg):
+    assert titles(epg.overlapping("bbc1", 100, 200)) == ["Quiz"]
+    assert titles(epg.overlapping("bbc1", 99, 101)) == ["Marathon", "Quiz"]
+    assert titles(epg.overlapping("bbc1", 300, 400)) == []
+
+def test_epg_index_drops_empty_programmes(epg):
+    assert titles(epg.overlapping("bbc1", 140, 160)) == ["Quiz"]
+
+def test_epg_index_resolves_display_names(epg):
+    assert "BBC  one" in epg
+    assert titles(epg.overlapping("bbc one", 250, 260)) == ["Film"]
+    assert epg.overlapping("itv", 0, 1000) == []
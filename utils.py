@@ -1,4 +1,9 @@
 import os
+import asyncio
+import logging
+import logging.handlers
+import queue
+import contextvars
 import requests
 import json
 import pytz
@@ -8,20 +13,833 @@ from subprocess import check_output
 from pytz import timezone 
 from urllib.request import urlopen, Request
 import shlex
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from xml.etree import ElementTree
+import io
+import sys
+import threading
+import traceback
+from collections import defaultdict
 import ffmpeg
 from hachoir.metadata import extractMetadata
 from hachoir.parser import createParser
+from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Fields (job_id, user_id, ingest) attached to every record logged from the current task
+log_context = contextvars.ContextVar("log_context", default={})
+
+def bind_log_context(**fields):
+    """Attach fields to every log record emitted from the current task (and tasks it creates)."""
+    log_context.set({**log_context.get(), **fields})
+
+class ContextFilter(logging.Filter):
+    """Copy the task's log context onto the record before it leaves the calling thread."""
+
+    def filter(self, record):
+        for key, value in log_context.get().items():
+            setattr(record, key, value)
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `limit` INFO/DEBUG records per call site through every `window` seconds.
+
+    Warnings and errors always pass. When a call site's window rolls over,
+    the first record through carries the number of records suppressed.
+    """
+
+    def __init__(self, limit, window):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.sites = {}  # (pathname, lineno) -> [window start, passed, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.limit <= 0:
+            return True
+        now = time.monotonic()
+        site = self.sites.get((record.pathname, record.lineno))
+        if site is None or now - site[0] >= self.window:
+            suppressed = site[2] if site else 0
+            self.sites[(record.pathname, record.lineno)] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if site[1] < self.limit:
+            site[1] += 1
+            return True
+        site[2] += 1
+        return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the writer falls behind."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including job_id/user_id/ingest when bound."""
+
+    fields = ("job_id", "user_id", "ingest", "suppressed")
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in self.fields:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+def setup_logging():
+    """Route all logging through a bounded queue drained by a background writer thread.
+
+    The event loop only pays for the filters and a put_nowait; formatting and
+    disk/console I/O happen on the listener thread. Returns the listener so
+    the caller can stop (flush) it on shutdown.
+    """
+    level = getattr(logging, Config.LOG_LEVEL.upper(), logging.INFO)
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    handlers = [console]
+    if Config.LOG_FILE:
+        os.makedirs(os.path.dirname(Config.LOG_FILE) or ".", exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            Config.LOG_FILE, maxBytes=Config.LOG_MAX_MB * 1024 * 1024, backupCount=Config.LOG_BACKUPS,
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(JSONFormatter())
+        handlers.append(file_handler)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(Config.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter(Config.LOG_RATE_LIMIT, Config.LOG_RATE_WINDOW))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
 
 iptv_link = "https://gist.githubusercontent.com/kunani1/a048909a292d308d63dabc72acb58200/raw/34f9288582d480d9eea490d0937b57416c448e0d/links.json"
 
+# Shared keep-alive session for playlist, segment and catalog requests
+http_session = requests.Session()
+http_session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+http_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+HTTP_TIMEOUT = (5, 15)  # (connect, read) seconds
+
+def parse_m3u8(text, base_url):
+    """Parse an HLS playlist into its variants, renditions and segments."""
+    playlist = {
+        "media_sequence": 0,
+        "target_duration": None,
+        "variants": [],
+        "media": [],
+        "segments": [],
+        "endlist": False,
+    }
+    segment = {}
+    stream_inf = None
+    sequence = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            playlist["media_sequence"] = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            playlist["target_duration"] = float(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-ENDLIST"):
+            playlist["endlist"] = True
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            stream_inf = parse_m3u8_attributes(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MEDIA:"):
+            media = parse_m3u8_attributes(line.split(":", 1)[1])
+            if "URI" in media:
+                media["URI"] = urljoin(base_url, media["URI"])
+            playlist["media"].append(media)
+        elif line.startswith("#EXTINF:"):
+            segment["duration"] = float(line.split(":", 1)[1].split(",", 1)[0])
+        elif line.startswith("#EXT-X-PROGRAM-DATE-TIME:"):
+            segment["program_date_time"] = parse_program_date_time(line.split(":", 1)[1])
+        elif line.startswith("#"):
+            continue
+        elif stream_inf is not None:
+            stream_inf["URI"] = urljoin(base_url, line)
+            playlist["variants"].append(stream_inf)
+            stream_inf = None
+        else:
+            if sequence is None:
+                sequence = playlist["media_sequence"]
+            segment["uri"] = urljoin(base_url, line)
+            segment["sequence"] = sequence
+            segment.setdefault("duration", playlist["target_duration"] or 0.0)
+            playlist["segments"].append(segment)
+            sequence += 1
+            segment = {}
+
+    # PROGRAM-DATE-TIME is usually only tagged on the first segment; carry it forward
+    clock = None
+    for segment in playlist["segments"]:
+        if segment.get("program_date_time") is not None:
+            clock = segment["program_date_time"]
+        elif clock is not None:
+            segment["program_date_time"] = clock
+        if clock is not None:
+            clock += segment["duration"]
+    return playlist
+
+def parse_m3u8_attributes(text):
+    """Parse an attribute list such as BANDWIDTH=1280000,CODECS="avc1,mp4a"."""
+    attributes = {}
+    for match in re.finditer(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', text):
+        attributes[match.group(1)] = match.group(2).strip('"')
+    return attributes
+
+def parse_program_date_time(value):
+    """Convert an EXT-X-PROGRAM-DATE-TIME value to a POSIX timestamp."""
+    try:
+        return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+def fetch_playlist(url):
+    """Download and parse an HLS playlist."""
+    response = http_session.get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return parse_m3u8(response.text, response.url)
+
+def align_playlists(playlists):
+    """Find the segment index in each live playlist that starts at a common moment.
+
+    Prefers EXT-X-PROGRAM-DATE-TIME, then media sequence numbers. Returns
+    (method, indices) with indices usable as ffmpeg's -live_start_index, or
+    ("pts", None) when the playlists carry neither and alignment has to be
+    done on the captured timestamps instead. Indices are negative, counted
+    back from the live edge (-1 is the newest segment): the playlist slides
+    before ffmpeg opens it, and an offset from its start would then point at
+    a later segment than the one aligned.
+    """
+    if not playlists or not all(pl["segments"] for pl in playlists):
+        return "pts", None
+
+    if all(seg.get("program_date_time") is not None for pl in playlists for seg in pl["segments"]):
+        # Newest moment every rendition already has a segment for
+        target = min(pl["segments"][-1]["program_date_time"] for pl in playlists)
+        indices = []
+        for pl in playlists:
+            starts = [seg["program_date_time"] for seg in pl["segments"]]
+            index = max((i for i, start in enumerate(starts) if start <= target + 0.001), default=None)
+            if index is None or starts[index] + pl["segments"][index]["duration"] <= target:
+                break
+            indices.append(index - len(pl["segments"]))
+        else:
+            return "program-date-time", indices
+
+    target = min(pl["segments"][-1]["sequence"] for pl in playlists)
+    if all(pl["segments"][0]["sequence"] <= target for pl in playlists):
+        return "media-sequence", [target - pl["segments"][-1]["sequence"] - 1 for pl in playlists]
+    return "pts", None
+
+TS_PACKET_SIZE = 188
+PTS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1B, 0x24, 0x42}
+AUDIO_STREAM_TYPES = {0x03, 0x04, 0x0F, 0x11, 0x81, 0x87}
+
+class TSValidator:
+    """Incremental MPEG-TS checker for captured segments.
+
+    Feed segments in order; state (continuity counters, last timestamps)
+    carries across them. Each call reports the seconds of video and audio
+    actually covered, timestamp gaps and continuity-counter errors.
+    Nothing is decoded, so a "frozen" picture shows up as missing video
+    PES rather than identical frames.
+    """
+
+    def __init__(self, gap_threshold=1.0):
+        self.gap_threshold = gap_threshold
+        self.pmt_pids = set()
+        self.stream_kinds = {}  # pid -> "video" | "audio"
+        self.continuity = {}
+        self.last_ts = {}
+        self.cc_errors = 0
+
+    def feed_file(self, path):
+        with open(path, "rb") as f:
+            return self.feed(f.read())
+
+    def feed(self, data):
+        covered = defaultdict(float)  # pid -> seconds
+        report = {"video": 0.0, "audio": 0.0, "gaps": [], "cc_errors": 0, "start": None, "end": None}
+        for offset in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+            packet = data[offset:offset + TS_PACKET_SIZE]
+            if packet[0] != 0x47:
+                report["cc_errors"] += 1
+                continue
+            pid = ((packet[1] & 0x1F) << 8) | packet[2]
+            if pid == 0x1FFF:
+                continue
+            unit_start = packet[1] & 0x40
+            adaptation = (packet[3] >> 4) & 0x3
+            counter = packet[3] & 0x0F
+            payload = 4
+            discontinuity = False
+            if adaptation & 0x2:
+                discontinuity = packet[4] > 0 and bool(packet[5] & 0x80)
+                payload += 1 + packet[4]
+            if adaptation & 0x1:
+                previous = self.continuity.get(pid)
+                if previous is not None and not discontinuity and counter not in (previous, (previous + 1) & 0x0F):
+                    report["cc_errors"] += 1
+                self.continuity[pid] = counter
+            if not unit_start or payload >= TS_PACKET_SIZE:
+                continue
+
+            if pid == 0:
+                self._parse_pat(packet[payload:])
+            elif pid in self.pmt_pids:
+                self._parse_pmt(packet[payload:])
+            elif pid in self.stream_kinds:
+                timestamp = self._pes_timestamp(packet[payload:])
+                if timestamp is None:
+                    continue
+                seconds = timestamp / PTS_CLOCK
+                report["start"] = seconds if report["start"] is None else report["start"]
+                report["end"] = seconds
+                last = self.last_ts.get(pid)
+                self.last_ts[pid] = timestamp
+                if last is None:
+                    continue
+                delta = (timestamp - last) % PTS_WRAP
+                if delta > PTS_WRAP // 2:
+                    continue  # Went backwards (reordering or a reset); just re-anchor
+                delta /= PTS_CLOCK
+                if delta <= self.gap_threshold:
+                    covered[pid] += delta
+                else:
+                    report["gaps"].append({"kind": self.stream_kinds[pid], "at": last / PTS_CLOCK, "length": delta})
+
+        for pid, seconds in covered.items():
+            kind = self.stream_kinds[pid]
+            report[kind] = max(report[kind], seconds)
+        report["audio_tracks"] = sum(1 for kind in self.stream_kinds.values() if kind == "audio")
+        self.cc_errors += report["cc_errors"]
+        return report
+
+    @staticmethod
+    def _section(payload):
+        pointer = payload[0]
+        section = payload[1 + pointer:]
+        if len(section) < 3:
+            return None
+        length = ((section[1] & 0x0F) << 8) | section[2]
+        return section[:3 + length]
+
+    def _parse_pat(self, payload):
+        section = self._section(payload)
+        if not section or section[0] != 0x00:
+            return
+        for i in range(8, len(section) - 4, 4):
+            program = (section[i] << 8) | section[i + 1]
+            if program != 0:
+                self.pmt_pids.add(((section[i + 2] & 0x1F) << 8) | section[i + 3])
+
+    def _parse_pmt(self, payload):
+        section = self._section(payload)
+        if not section or section[0] != 0x02 or len(section) < 12:
+            return
+        i = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        while i + 5 <= len(section) - 4:
+            stream_type = section[i]
+            pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+            if stream_type in VIDEO_STREAM_TYPES:
+                self.stream_kinds[pid] = "video"
+            elif stream_type in AUDIO_STREAM_TYPES:
+                self.stream_kinds[pid] = "audio"
+            i += 5 + (((section[i + 3] & 0x0F) << 8) | section[i + 4])
+
+    @staticmethod
+    def _pes_timestamp(payload):
+        """DTS when present (monotonic for video), otherwise PTS, in 90 kHz ticks."""
+        if len(payload) < 19 or payload[:3] != b"\x00\x00\x01":
+            return None
+        flags = payload[7] >> 6
+        if not flags & 0x2:
+            return None
+        field = payload[14:19] if flags == 0x3 else payload[9:14]
+        return (((field[0] >> 1) & 0x07) << 30) | (field[1] << 22) | ((field[2] >> 1) << 15) | \
+               (field[3] << 7) | (field[4] >> 1)
+
+def measure_throughput(url, segment_count=3, fallback_bitrate=None, sample_seconds=4.0):
+    """Download the newest segments of a stream and return its realtime factor.
+
+    The factor is seconds of media fetched per second of wall-clock time; a
+    value below 1.0 means the stream cannot be recorded as fast as it plays.
+    Non-HLS sources are sampled for `sample_seconds` and converted to media
+    time using `fallback_bitrate` (kbps).
+    """
+    started = time.monotonic()
+    playlist = fetch_playlist(url) if ".m3u8" in url else None
+    if playlist and playlist["variants"]:
+        # Master playlist: measure the first variant it lists
+        playlist = fetch_playlist(playlist["variants"][0]["URI"])
+
+    if playlist and playlist["segments"]:
+        media_seconds = 0.0
+        started = time.monotonic()
+        for segment in playlist["segments"][-segment_count:]:
+            response = http_session.get(segment["uri"], timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            media_seconds += segment["duration"]
+        elapsed = max(time.monotonic() - started, 1e-6)
+        return media_seconds / elapsed
+
+    if not fallback_bitrate:
+        return 0.0
+    received = 0
+    with http_session.get(url, timeout=HTTP_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=65536):
+            received += len(chunk)
+            if time.monotonic() - started >= sample_seconds:
+                break
+    elapsed = max(time.monotonic() - started, 1e-6)
+    return (received * 8 / 1000 / fallback_bitrate) / elapsed
+
 def fetch_data(url):
-    data = requests.get(url)
-    data = data.text
-    return json.loads(data)
-
-def getChannels(app, message):
-    data = fetch_data(iptv_link)
-    channelsList = ""
-    for i in data:
-        channelsList += f"{i}\n"
-    message.reply_text(text=f"Available Channels:\n\n{channelsList}")
+    data = http_session.get(url, timeout=HTTP_TIMEOUT)
+    data.raise_for_status()
+    return json.loads(data.text)
+
+class CatalogFetcher:
+    """Keeps a JSON catalog in memory, refreshed in the background with conditional GETs.
+
+    The last good copy is persisted to `cache_path` so a restart (or a broken
+    upstream) still serves channels immediately. `url` may also be a local
+    path, re-read when its mtime changes; `parse` turns the raw body into
+    the (JSON-serializable) data.
+    """
+
+    def __init__(self, url, cache_path, interval=900, timeout=20, parse=json.loads, name="Catalog"):
+        self.url = url
+        self.parse = parse
+        self.name = name
+        self.cache_path = cache_path
+        self.interval = interval
+        self.timeout = timeout
+        self.data = {}
+        self.etag = None
+        self.last_modified = None
+        self.last_refresh = None
+        self.last_error = None
+        self.listeners = []  # Called in a worker thread with the new data after every change
+        self._task = None
+        self._load_cache()
+
+    def get(self):
+        return self.data
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+        if self.data:
+            callback(self.data)
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            self.data = cached.get("data", {})
+            self.etag = cached.get("etag")
+            self.last_modified = cached.get("last_modified")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable catalog cache {self.cache_path}: {e}")
+
+    def _save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"etag": self.etag, "last_modified": self.last_modified, "data": self.data}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _fetch(self):
+        """Blocking conditional GET; returns the parsed body, or None when unchanged."""
+        if not re.match(r"https?://", self.url):
+            modified = str(os.path.getmtime(self.url))
+            if modified == self.last_modified:
+                return None
+            with open(self.url, "rb") as f:
+                data = self.parse(f.read())
+            self.last_modified = modified
+            return data
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        response = http_session.get(self.url, headers=headers, timeout=HTTP_TIMEOUT)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        data = self.parse(response.content)
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        return data
+
+    async def refresh(self):
+        try:
+            data = await asyncio.wait_for(asyncio.to_thread(self._fetch), timeout=self.timeout)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"{self.name} refresh failed, serving cached copy: {self.last_error}")
+            return False
+        self.last_refresh = time.time()
+        self.last_error = None
+        if data is None:
+            return False
+        self.data = data
+        try:
+            await asyncio.to_thread(self._save_cache)
+        except Exception as e:
+            logger.warning(f"Could not write {self.name.lower()} cache {self.cache_path}: {e}")
+        for callback in self.listeners:
+            await asyncio.to_thread(callback, self.data)
+        logger.info(f"{self.name} refreshed: {len(self.data)} entries")
+        return True
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+channel_catalog = CatalogFetcher(iptv_link, Config.CATALOG_CACHE_PATH, Config.CATALOG_REFRESH_INTERVAL)
+
+def catalog_items(data):
+    """Yield (name, link) pairs from the catalog, whether it is a mapping or a list of entries."""
+    if isinstance(data, dict):
+        yield from ((str(name), link) for name, link in data.items())
+    else:
+        for entry in data:
+            if isinstance(entry, dict):
+                yield str(entry.get("name", "")), entry.get("link") or entry.get("url")
+
+class ChannelIndex:
+    """Prefix index over channel names with a trigram fallback for typos.
+
+    Every word suffix of a name ("Star Sports 1" -> "starsports1",
+    "sports1", "1") is stored in one sorted list, so a prefix lookup is two
+    bisections plus the size of the result. Fuzzy matching only scores names
+    sharing one of the query's rarest trigrams, which keeps it bounded too.
+    The tables are swapped in as one snapshot, so a rebuild in a worker
+    thread never exposes a half-built index to readers.
+    """
+
+    def __init__(self, data=None):
+        self._snapshot = ([], {}, [], [], {}, {})
+        if data:
+            self.build(data)
+
+    @property
+    def names(self):
+        return self._snapshot[0]
+
+    @property
+    def links(self):
+        return self._snapshot[1]
+
+    @staticmethod
+    def normalize(text):
+        return re.sub(r"[^a-z0-9]+", "", text.lower())
+
+    @staticmethod
+    def _trigrams(key):
+        return {key[i:i + 3] for i in range(max(len(key) - 2, 1))}
+
+    def build(self, data):
+        names, links, entries = [], {}, []
+        trigrams = defaultdict(list)
+        for name, link in catalog_items(data):
+            if not name or not link or name in links:
+                continue
+            name_id = len(names)
+            names.append(name)
+            links[name] = link
+            words = [self.normalize(word) for word in name.split()]
+            words = [word for word in words if word]
+            for i in range(len(words)):
+                entries.append(("".join(words[i:]), name_id))
+            for trigram in self._trigrams(self.normalize(name)):
+                trigrams[trigram].append(name_id)
+        entries.sort()
+        self._snapshot = (
+            names,
+            links,
+            [key for key, _ in entries],
+            [name_id for _, name_id in entries],
+            {self.normalize(name): name for name in names},
+            dict(trigrams),
+        )
+        logger.info(f"Channel index built: {len(names)} channels, {len(entries)} keys")
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefix(self, query, limit=None, snapshot=None):
+        names, _, keys, key_names, _, _ = snapshot or self._snapshot
+        key = self.normalize(query)
+        if not key:
+            return names[:limit] if limit else list(names)
+        start = bisect_left(keys, key)
+        end = bisect_left(keys, key + "\x7f", lo=start)
+        seen, results = set(), []
+        for name_id in key_names[start:end]:
+            if name_id not in seen:
+                seen.add(name_id)
+                results.append(names[name_id])
+                if limit and len(results) >= limit:
+                    break
+        return results
+
+    def fuzzy(self, query, limit=20, threshold=0.3, probe_trigrams=3, snapshot=None):
+        names, _, _, _, _, trigrams = snapshot or self._snapshot
+        key = self.normalize(query)
+        if len(key) < 3:
+            return []
+        query_trigrams = self._trigrams(key)
+        rarest = sorted((t for t in query_trigrams if t in trigrams), key=lambda t: len(trigrams[t]))
+        candidates = {name_id for t in rarest[:probe_trigrams] for name_id in trigrams[t]}
+        scored = []
+        for name_id in candidates:
+            name_trigrams = self._trigrams(self.normalize(names[name_id]))
+            shared = len(query_trigrams & name_trigrams)
+            score = shared / (len(query_trigrams) + len(name_trigrams) - shared)
+            if score >= threshold:
+                scored.append((-score, names[name_id]))
+        scored.sort()
+        return [name for _, name in scored[:limit]]
+
+    def search(self, query, limit=None, snapshot=None):
+        """Prefix matches first, topped up with fuzzy matches when there are few of them."""
+        snapshot = snapshot or self._snapshot
+        results = self.prefix(query, limit, snapshot)
+        if len(results) < (limit or 10):
+            seen = set(results)
+            results += [name for name in self.fuzzy(query, snapshot=snapshot) if name not in seen]
+        return results[:limit] if limit else results
+
+    def search_links(self, query, limit=None):
+        """search() results paired with their links, all read from one snapshot."""
+        snapshot = self._snapshot
+        return [(name, snapshot[1][name]) for name in self.search(query, limit, snapshot)]
+
+    def resolve(self, name):
+        """Map a channel name (exact, or an unambiguous prefix) to its link."""
+        snapshot = self._snapshot
+        _, links, _, _, exact, _ = snapshot
+        match = exact.get(self.normalize(name))
+        if match is None:
+            candidates = self.prefix(name, limit=2, snapshot=snapshot)
+            if len(candidates) != 1:
+                return None
+            match = candidates[0]
+        return links[match]
+
+channel_index = ChannelIndex()
+channel_catalog.add_listener(channel_index.build)
+
+def parse_xmltv(data):
+    """Parse an XMLTV guide into {"channels": {id: [display names]}, "programmes": [...]}.
+
+    Programmes are {"channel", "start", "stop", "title"} with epoch seconds;
+    ones without a parseable start/stop are skipped. Elements are cleared as
+    they are read, so weeks of guide data parse in bounded memory.
+    """
+    channels, programmes = {}, []
+    for _, element in ElementTree.iterparse(io.BytesIO(data), events=("end",)):
+        if element.tag == "channel":
+            channels[element.get("id")] = [name.text.strip() for name in element.findall("display-name") if name.text]
+            element.clear()
+        elif element.tag == "programme":
+            try:
+                start = datetime.strptime(element.get("start", ""), "%Y%m%d%H%M%S %z").timestamp()
+                stop = datetime.strptime(element.get("stop", ""), "%Y%m%d%H%M%S %z").timestamp()
+            except ValueError:
+                element.clear()
+                continue
+            title = element.findtext("title") or ""
+            programmes.append({"channel": element.get("channel"), "start": start, "stop": stop, "title": title.strip()})
+            element.clear()
+    return {"channels": channels, "programmes": programmes}
+
+class EPGIndex:
+    """Per-channel interval index over guide programmes.
+
+    Each channel keeps its programmes sorted by start, alongside the running
+    maximum of their stop times. Both arrays are monotonic, so the programmes
+    overlapping [start, end) lie between two bisections: O(log n) plus the
+    size of the result, however many weeks of guide are loaded. Channels are
+    reachable by XMLTV id and by every display name (normalized like
+    ChannelIndex).
+    """
+
+    def __init__(self, data=None):
+        self._snapshot = {}
+        if data:
+            self.build(data)
+
+    def build(self, data):
+        by_channel = defaultdict(list)
+        for programme in data.get("programmes", []):
+            if programme["stop"] > programme["start"]:
+                by_channel[programme["channel"]].append(programme)
+        index = {}
+        for channel_id, programmes in by_channel.items():
+            programmes.sort(key=lambda programme: programme["start"])
+            entry = (
+                [programme["start"] for programme in programmes],
+                list(accumulate((programme["stop"] for programme in programmes), max)),
+                programmes,
+            )
+            for name in [channel_id, *data.get("channels", {}).get(channel_id, [])]:
+                index.setdefault(ChannelIndex.normalize(name or ""), entry)
+        self._snapshot = index
+        logger.info(f"EPG index built: {len(by_channel)} channels, {sum(map(len, by_channel.values()))} programmes")
+
+    def __contains__(self, channel):
+        return ChannelIndex.normalize(channel) in self._snapshot
+
+    def overlapping(self, channel, start, end):
+        """Programmes on `channel` that overlap [start, end), in start order."""
+        entry = self._snapshot.get(ChannelIndex.normalize(channel))
+        if entry is None:
+            return []
+        starts, reach, programmes = entry
+        lo = bisect_right(reach, start)  # Everything before ends at or before `start`
+        hi = bisect_left(starts, end)    # Everything from here starts at or after `end`
+        return [programme for programme in programmes[lo:hi] if programme["stop"] > start]
+
+epg_guide = CatalogFetcher(Config.EPG_SOURCE, Config.EPG_CACHE_PATH, Config.EPG_REFRESH_INTERVAL,
+                           timeout=120, parse=parse_xmltv, name="EPG")
+epg_index = EPGIndex()
+epg_guide.add_listener(epg_index.build)
+
+class BlockingCallDetector:
+    """Debug instrumentation that finds callbacks blocking the event loop.
+
+    `install` wraps asyncio's Handle._run to time every callback the loop
+    runs. A watchdog thread snapshots the loop thread's stack when a
+    callback has been running for `threshold` seconds, so the report points
+    at the blocking call itself (subprocess.run, a file read, yt_dlp) and
+    not just the task that made it. Offenders are aggregated by call site.
+    Meant for debugging and load tests: it adds overhead to every callback.
+    """
+
+    def __init__(self, threshold=0.1):
+        self.threshold = threshold
+        self.offenders = {}  # call site -> {"count", "total", "max", "task", "stack"}
+        self.root = os.path.dirname(os.path.abspath(__file__))
+        self._current = None  # [handle, started, stack] of the callback running right now
+        self._original_run = None
+        self._loop_thread = None
+        self._stop = threading.Event()
+
+    def install(self):
+        """Start instrumenting; call from the event loop's thread."""
+        if self._original_run is not None:
+            return
+        detector, original = self, asyncio.events.Handle._run
+        self._original_run = original
+        self._loop_thread = threading.get_ident()
+
+        def _run(handle):
+            if threading.get_ident() != detector._loop_thread:
+                return original(handle)
+            current = detector._current = [handle, time.perf_counter(), None]
+            try:
+                return original(handle)
+            finally:
+                detector._current = None
+                elapsed = time.perf_counter() - current[1]
+                if elapsed >= detector.threshold:
+                    detector._record(handle, elapsed, current[2])
+
+        asyncio.events.Handle._run = _run
+        self._stop.clear()
+        threading.Thread(target=self._watch, name="blocking-call-detector", daemon=True).start()
+        logger.warning(f"Blocking-call detector installed (threshold {self.threshold * 1000:.0f} ms)")
+
+    def uninstall(self):
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+        self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 4):
+            current = self._current
+            if current is None or current[2] is not None or time.perf_counter() - current[1] < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None and current is self._current:
+                current[2] = traceback.extract_stack(frame)
+
+    @staticmethod
+    def describe(handle):
+        """Name of the coroutine (for task steps) or function a handle runs."""
+        callback = getattr(handle, "_callback", None)
+        owner = getattr(callback, "__self__", None)
+        if isinstance(owner, asyncio.Task):
+            return owner.get_coro().__qualname__
+        return getattr(callback, "__qualname__", repr(callback))
+
+    def _record(self, handle, elapsed, stack):
+        task = self.describe(handle)
+        site = task
+        if stack:
+            # Innermost frame in this project, i.e. the line that made the blocking call
+            ours = [frame for frame in stack if frame.filename.startswith(self.root) and frame.filename != __file__]
+            frame = (ours or stack)[-1]
+            site = f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+        entry = self.offenders.setdefault(site, {"count": 0, "total": 0.0, "max": 0.0, "task": task, "stack": stack})
+        entry["count"] += 1
+        entry["total"] += elapsed
+        entry["max"] = max(entry["max"], elapsed)
+        logger.warning(f"Event loop blocked {elapsed * 1000:.0f} ms by {site} (task {task})")
+
+    def report(self, limit=10, stack_depth=6):
+        """Offenders by total blocked time, each with the tail of a sampled stack."""
+        if not self.offenders:
+            return "No blocking callbacks detected."
+        lines = ["Blocking callbacks (count, total ms, max ms, call site, task):"]
+        ranked = sorted(self.offenders.items(), key=lambda item: item[1]["total"], reverse=True)
+        for site, entry in ranked[:limit]:
+            lines.append(f"{entry['count']:>5} {entry['total'] * 1000:>9.0f} {entry['max'] * 1000:>8.0f}  {site}  ({entry['task']})")
+            for frame in (entry["stack"] or [])[-stack_depth:]:
+                lines.append(f"        {os.path.basename(frame.filename)}:{frame.lineno} {frame.name}: {frame.line}")
+        return "\n".join(lines)